@@ -1,6 +1,25 @@
 __version__ = '0.0.6'
-from embeddings.glove import GloveEmbedding
-from embeddings.fasttext import FastTextEmbedding
-from embeddings.kazuma import KazumaCharEmbedding
-from embeddings.concat import ConcatEmbedding
-from embeddings.numberbatch import NumberbatchEmbedding
+
+# backends are imported on first access, so that importing the package does not import every backend and its dependencies.
+_backends = {
+    'GloveEmbedding': 'embeddings.glove',
+    'FastTextEmbedding': 'embeddings.fasttext',
+    'KazumaCharEmbedding': 'embeddings.kazuma',
+    'ConcatEmbedding': 'embeddings.concat',
+    'NumberbatchEmbedding': 'embeddings.numberbatch',
+}
+
+__all__ = list(_backends)
+
+
+def __getattr__(name):
+    if name not in _backends:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+    from importlib import import_module
+    value = getattr(import_module(_backends[name]), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
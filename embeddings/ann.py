@@ -0,0 +1,211 @@
+import json
+from os import path, makedirs, remove
+
+import numpy as np
+from numpy.lib.format import open_memmap
+
+from embeddings.similarity import normalize, search, topk
+
+
+def assign(vectors, centroids, block_size=65536, spherical=True):
+    """
+
+    Args:
+        vectors (numpy.ndarray): ``(n, d)`` matrix of vectors.
+        centroids (numpy.ndarray): ``(n_lists, d)`` matrix of centroids.
+        block_size (int): number of vectors to assign at a time.
+        spherical (bool): whether to assign by highest dot product, as for normalized vectors, rather than by lowest Euclidean distance.
+
+    Returns:
+        numpy.ndarray: the index of the closest centroid for each vector.
+
+    """
+    bias = 0 if spherical else -0.5 * (centroids ** 2).sum(axis=1)
+    out = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start+block_size])
+        out[start:start+len(block)] = np.argmax(block @ centroids.T + bias, axis=1)
+    return out
+
+
+def kmeans(vectors, n_clusters, n_iter=10, seed=0, spherical=True):
+    """
+    K-means with Lloyd's algorithm. Empty clusters are reseeded with random vectors.
+
+    Args:
+        vectors (numpy.ndarray): ``(n, d)`` matrix of vectors, normalized if ``spherical``.
+        n_clusters (int): number of clusters.
+        n_iter (int): number of iterations.
+        seed (int): random seed.
+        spherical (bool): whether to cluster by cosine similarity with normalized centroids rather than by Euclidean distance.
+
+    Returns:
+        numpy.ndarray: ``(n_clusters, d)`` matrix of centroids.
+
+    """
+    rng = np.random.RandomState(seed)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        labels = assign(vectors, centroids, spherical=spherical)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=n_clusters)
+        nonempty = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[nonempty]
+        centroids[nonempty] = np.add.reduceat(vectors[order], starts, axis=0)
+        if not spherical:
+            centroids[nonempty] /= counts[nonempty, None]
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+        if spherical:
+            normalize(centroids)
+    return centroids
+
+
+class IVFIndex:
+    """
+    An inverted file index for approximate nearest neighbour search over normalized embeddings.
+
+    The vectors are clustered with spherical k-means into ``n_lists`` lists. A query only scores the vectors in the ``nprobe`` lists
+    whose centroids are closest to it, trading recall for speed. The index is a directory with the following files:
+
+    - ``centroids.npy``: the ``(n_lists, d_emb)`` normalized centroids.
+    - ``offsets.npy``: the start of each list in ``rows.npy`` and ``vectors.npy``.
+    - ``rows.npy``: the row of each vector in the matrix the index was built from, grouped by list.
+    - ``vectors.npy``: the vectors, grouped by list so that each list is scanned contiguously.
+    - ``meta.json``: build parameters and the measured recall, written last to mark the index as complete.
+    """
+
+    default_nprobe = 8
+
+    def __init__(self, dname):
+        """
+
+        Args:
+            dname (str): directory of the index.
+        """
+        self.dname = dname
+        with open(path.join(dname, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.centroids = np.load(path.join(dname, 'centroids.npy'))
+        self.offsets = np.load(path.join(dname, 'offsets.npy'))
+        self.rows = np.load(path.join(dname, 'rows.npy'), mmap_mode='r')
+        self.vectors = np.load(path.join(dname, 'vectors.npy'), mmap_mode='r')
+
+    @staticmethod
+    def exists(dname):
+        """
+        Returns:
+            bool: whether a complete index exists at ``dname``.
+        """
+        return path.isfile(path.join(dname, 'meta.json'))
+
+    @classmethod
+    def build(cls, dname, vectors, n_lists=None, n_iter=10, sample_size=None, seed=0, meta=None):
+        """
+        Builds an index over ``vectors`` and saves it to ``dname``.
+
+        Args:
+            dname (str): directory of the index.
+            vectors (numpy.ndarray): ``(n, d_emb)`` matrix of normalized vectors, which may be memory-mapped.
+            n_lists (int): number of lists. Defaults to ``sqrt(n)``.
+            n_iter (int): number of k-means iterations.
+            sample_size (int): number of vectors to train k-means on. Defaults to ``64 * n_lists``.
+            seed (int): random seed.
+            meta (dict): additional information to record in ``meta.json``.
+
+        Returns:
+            IVFIndex: the index.
+
+        """
+        if not path.isdir(dname):
+            makedirs(dname)
+        if cls.exists(dname):
+            remove(path.join(dname, 'meta.json'))
+        n = len(vectors)
+        n_lists = min(n, n_lists or max(1, int(np.sqrt(n))))
+        sample_size = min(n, sample_size or 64 * n_lists)
+        rng = np.random.RandomState(seed)
+        sample = np.sort(rng.choice(n, sample_size, replace=False))
+        centroids = kmeans(vectors[sample], n_lists, n_iter=n_iter, seed=seed)
+
+        labels = assign(vectors, centroids)
+        rows = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+        out = open_memmap(path.join(dname, 'vectors.npy'), mode='w+', dtype=np.float32, shape=(n, vectors.shape[1]))
+        for start in range(0, n, 65536):
+            out[start:start+65536] = vectors[rows[start:start+65536]]
+        out.flush()
+        del out
+        np.save(path.join(dname, 'centroids.npy'), centroids)
+        np.save(path.join(dname, 'offsets.npy'), offsets)
+        np.save(path.join(dname, 'rows.npy'), rows)
+
+        meta = dict(meta or {}, n_lists=n_lists, size=n, seed=seed)
+        with open(path.join(dname, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+        index = cls(dname)
+        queries = np.asarray(vectors[np.sort(rng.choice(n, min(n, 100), replace=False))])
+        index.meta['recall'] = dict(k=10, nprobe=cls.default_nprobe, recall=index.recall(queries, k=10, nprobe=cls.default_nprobe))
+        with open(path.join(dname, 'meta.json'), 'w') as f:
+            json.dump(index.meta, f)
+        return index
+
+    def load_memory(self):
+        """
+        Reads the index into memory, so that searches no longer touch the disk.
+        """
+        self.rows = np.array(self.rows)
+        self.vectors = np.array(self.vectors)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def search(self, queries, k, nprobe=None, exclude=None):
+        """
+
+        Args:
+            queries (numpy.ndarray): ``(n_queries, d_emb)`` matrix of normalized queries.
+            k (int): number of results per query.
+            nprobe (int): number of lists to scan per query. Higher values are slower but more accurate.
+            exclude (numpy.ndarray): optional row to exclude for each query, ``-1`` to exclude nothing.
+
+        Returns:
+            list: a tuple ``(scores, rows)`` for each query, sorted by decreasing score.
+            There are fewer than ``k`` results if the probed lists hold fewer vectors.
+
+        """
+        nprobe = min(nprobe or self.default_nprobe, len(self.centroids))
+        queries = np.asarray(queries, dtype=np.float32)
+        _, probes = topk(queries @ self.centroids.T, np.broadcast_to(np.arange(len(self.centroids)), (len(queries), len(self.centroids))), nprobe)
+        results = []
+        for i, (q, lists) in enumerate(zip(queries, probes)):
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l+1]) for l in lists])
+            scores = np.asarray(self.vectors[candidates]) @ q
+            rows = np.asarray(self.rows[candidates])
+            if exclude is not None and exclude[i] >= 0:
+                keep = rows != exclude[i]
+                scores, rows = scores[keep], rows[keep]
+            scores, rows = topk(scores[None], rows[None], k)
+            results.append((scores[0], rows[0]))
+        return results
+
+    def recall(self, queries, k=10, nprobe=None):
+        """
+
+        Args:
+            queries (numpy.ndarray): ``(n_queries, d_emb)`` matrix of normalized queries.
+            k (int): number of results per query.
+            nprobe (int): number of lists to scan per query.
+
+        Returns:
+            float: the fraction of the exact top ``k`` neighbours that the index also returns.
+
+        """
+        queries = np.asarray(queries, dtype=np.float32)
+        _, exact = search(self.vectors, queries, k)
+        exact = np.asarray(self.rows)[exact]
+        approx = self.search(queries, k, nprobe=nprobe)
+        hits = sum(len(np.intersect1d(e, a)) for e, (_, a) in zip(exact, approx))
+        return hits / exact.size if exact.size else 1.
@@ -0,0 +1,85 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe cache that evicts the least recently used entry when full.
+
+    Example:
+
+    .. code-block:: python
+
+        c = LRUCache(maxsize=2)
+        c.put('hello', [1, 2, 3])
+        c.get('hello')  # (True, [1, 2, 3])
+        c.get('world')  # (False, None)
+        c.stats()  # {'hits': 1, 'misses': 1, 'evictions': 0, 'size': 1, 'maxsize': 2}
+    """
+
+    def __init__(self, maxsize=100000):
+        """
+
+        Args:
+            maxsize (int): maximum number of entries to keep.
+        """
+        assert maxsize > 0, 'maxsize must be positive'
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+
+        Args:
+            key: key to look up.
+
+        Returns:
+            tuple: ``(True, value)`` if ``key`` is cached, ``(False, None)`` otherwise.
+
+        """
+        with self.lock:
+            try:
+                value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, value):
+        """
+
+        Args:
+            key: key to cache.
+            value: value to cache. ``None`` is a valid value, which is used to cache misses.
+
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries. The statistics are kept.
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+
+        Returns:
+            dict: the number of hits, misses and evictions, as well as the current and maximum size.
+
+        """
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, size=len(self.entries), maxsize=self.maxsize)
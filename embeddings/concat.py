@@ -1,4 +1,14 @@
+import threading
+import numpy as np
+from os import path
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
 from embeddings.embedding import Embedding
+from embeddings.matrix import MatrixStore, MatrixWriter
+
+
+# marks the threads of ``run_async`` calls, whose batch calls run serially so that every query reads through a connection it can interrupt
+serial = threading.local()
 
 
 class ConcatEmbedding(Embedding):
@@ -6,24 +16,234 @@ class ConcatEmbedding(Embedding):
     A concatenation of multiple embeddings
     """
 
-    def __init__(self, embeddings, default='none'):
+    # joint store of precomputed concatenations, see ``materialize``.
+    materialized = None
+    # threads that query the embeddings concurrently, created by the first batch call, see ``close``.
+    executor = None
+
+    def __init__(self, embeddings, default='none', parallel=True, as_numpy=False):
         """
 
         Args:
             embeddings: embeddings to concatenate.
-            default: how to embed words that are out of vocabulary. Can use zeros, return ``None``, or generate random between ``[-0.1, 0.1]``.
+            default: how to embed words that are out of vocabulary. Can use zeros, return ``None``, generate random between ``[-0.1, 0.1]``, or ``hash`` the word into a vector in that range that is the same on every call.
+            parallel: whether batch lookups query the embeddings concurrently, one thread per embedding.
+            as_numpy: whether ``emb`` returns a float32 ``numpy.ndarray`` instead of a list.
         """
         for e in embeddings:
             assert isinstance(e, Embedding), '{} is not an Embedding object'.format(e)
-        assert default in {'none', 'random', 'zero'}
+        assert default in {'none', 'random', 'zero', 'hash'}
 
         self.embeddings = embeddings
         self.default = default
+        self.as_numpy = as_numpy
+        self.d_emb = sum(e.d_emb for e in embeddings)
+        self.parallel = parallel and len(embeddings) > 1
+        self.executor_lock = threading.Lock()
+
+    def materialize(self, name, words=None, batch_size=10000, rebuild=False):
+        """
+        Precomputes the concatenated embeddings of a vocabulary into one memory-mapped matrix store, so that embedding a word in the
+        vocabulary is a single lookup. Words outside of the vocabulary fall through to the embeddings being concatenated.
+
+        Only words that exist in every embedding are stored, so that the stored rows never depend on ``default``.
+        The store records the dimensions and the ``source_version`` of each embedding, and is rebuilt from ``words`` if they no longer match.
+
+        Args:
+            name (str): name of the store, which is kept in ``$EMBEDDINGS_ROOT/concat/<name>.mmap``.
+            words (iterable): vocabulary to precompute. Required if the store does not exist yet or no longer matches the embeddings.
+            batch_size (int): number of words to compute at a time.
+            rebuild (bool): whether to rebuild the store even if it exists.
+
+        Returns:
+            MatrixStore: the store.
+
+        """
+        dname = self.path(path.join('concat', '{}.mmap'.format(name)))
+        meta = dict(
+            embeddings=[type(e).__name__ for e in self.embeddings],
+            d_embs=[e.d_emb for e in self.embeddings],
+            sources=[e.source_version() for e in self.embeddings],
+        )
+        if not rebuild and MatrixStore.exists(dname):
+            store = MatrixStore(dname)
+            if store.d_emb == self.d_emb and all(store.meta.get(k) == v for k, v in meta.items()):
+                self.materialized = store
+                return store
+            store.close()
+            assert words is not None, '{} was built from other embeddings, words are required to rebuild it'.format(dname)
+            rebuild = True
+        if rebuild or not MatrixStore.exists(dname):
+            assert words is not None, 'words are required to build {}'.format(dname)
+            with MatrixWriter(dname, self.d_emb, meta=meta) as writer:
+                batch = []
+                for w in words:
+                    batch.append(w)
+                    if len(batch) == batch_size:
+                        self._materialize_batch(writer, batch)
+                        batch = []
+                if batch:
+                    self._materialize_batch(writer, batch)
+        self.materialized = MatrixStore(dname)
+        return self.materialized
 
-    def emb(self, word, default=None):
+    def _materialize_batch(self, writer, words):
+        embs, oov = self._batch(words, lambda e, words, out: e.emb_batch(words, default='zero', out=out), None)
+        writer.insert_matrix([w for w, o in zip(words, oov) if not o], embs[~oov])
+
+    def enable_metrics(self, metrics=None, name=None):
+        """
+        Records the metrics of the concatenation and, in the same ``Metrics``, those of each embedding under ``<name>.<index>.<class>``,
+        so that the latency of the fan-out can be compared with that of each embedding.
+        The concatenation records ``emb`` and ``emb_batch`` latency, and ``materialized_hit`` for words read from the store of ``materialize``.
+        """
+        metrics = super().enable_metrics(metrics=metrics, name=name)
+        for i, e in enumerate(self.embeddings):
+            e.enable_metrics(metrics, name='{}.{}.{}'.format(self.metrics_name, i, type(e).__name__))
+        return metrics
+
+    def disable_metrics(self):
+        super().disable_metrics()
+        for e in self.embeddings:
+            e.disable_metrics()
+
+    def emb(self, word, default=None, as_numpy=None):
+        if self.metrics is None:
+            return self._emb(word, default, as_numpy)
+        start = perf_counter()
+        e = self._emb(word, default, as_numpy)
+        self.metrics.observe(self.metrics_name + '.emb', perf_counter() - start)
+        return e
+
+    def _emb(self, word, default, as_numpy):
+        if as_numpy is None:
+            as_numpy = self.as_numpy
+        if self.materialized is not None:
+            e = self.materialized.lookup(word)
+            if e is not None:
+                if self.metrics is not None:
+                    self.metrics.incr(self.metrics_name + '.materialized_hit')
+                return e if as_numpy else e.tolist()
         if default is None:
             default = self.default
+        if as_numpy:
+            parts = [e.emb(word, default=default, as_numpy=True) for e in self.embeddings]
+            return None if any(p is None for p in parts) else np.concatenate(parts)
         emb = []
         for e in self.embeddings:
             emb += e.emb(word, default=default)
         return emb
+
+    def serve(self, immutable=False, mmap_size=1 << 34):
+        for e in self.embeddings:
+            e.serve(immutable=immutable, mmap_size=mmap_size)
+
+    def async_pool(self):
+        if self.async_executor is None:
+            for e in self.embeddings:
+                if e.pool is None:
+                    e.serve()
+            self.async_executor = ThreadPoolExecutor(self.async_workers, thread_name_prefix='embeddings')
+        return self.async_executor
+
+    def fanout_pool(self):
+        """
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: the executor that queries the embeddings concurrently, one thread per embedding.
+        """
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(len(self.embeddings), thread_name_prefix='embeddings-concat')
+            return self.executor
+
+    def close(self):
+        """
+        Shuts down the threads of the concatenation: those of parallel batch calls and those of the async API.
+        They are created again by the next call that needs them.
+        """
+        with self.executor_lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        self.close_async()
+
+    async def run_async(self, f, *args, timeout=None):
+        """
+        Batch calls run serially on the thread of the call rather than on the threads of ``fanout_pool``, since cancellation only
+        interrupts the connections of the thread of the call.
+        """
+        def call(*args):
+            serial.active = True
+            try:
+                return f(*args)
+            finally:
+                serial.active = False
+        return await super().run_async(call, *args, timeout=timeout)
+
+    def readers(self):
+        return [db for e in self.embeddings for db in e.readers()]
+
+    def lookup_batch(self, words, out=None):
+        # the store built by ``materialize`` holds the rows of ``emb_batch``, which differ from lookups for embeddings such as Kazuma's
+        return self._record('lookup_batch', words, lambda e, words, out: e.lookup_batch(words, out=out), out, materialized=False)
+
+    def emb_batch(self, words, default=None, out=None):
+        """
+        Each embedding writes its block straight into its slice of one preallocated matrix.
+        If ``parallel`` is set, the embeddings are queried concurrently, so the call takes about as long as the slowest embedding.
+        Words in the store built by ``materialize`` are read from it instead.
+
+        Args:
+            words (list): words to embed.
+            default (str): how to embed words that are out of vocabulary. Defaults to ``self.default``.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into.
+
+        Returns:
+            tuple: the concatenated float32 embeddings and a boolean mask that is ``True`` for words that are out of vocabulary in any of the embeddings.
+        """
+        if default is None:
+            default = self.default
+        return self._record('emb_batch', words, lambda e, words, out: e.emb_batch(words, default=default, out=out), out)
+
+    def _record(self, event, words, f, out, materialized=True):
+        resolve = self._resolve if materialized else self._batch
+        if self.metrics is None:
+            return resolve(words, f, out)
+        words = list(words)
+        start = perf_counter()
+        embs, oov = resolve(words, f, out)
+        self.record_batch(event, start, len(words), int(oov.sum()))
+        return embs, oov
+
+    def _resolve(self, words, f, out):
+        if self.materialized is None:
+            return self._batch(words, f, out)
+        words = list(words)
+        embs = np.empty((len(words), self.d_emb), dtype=np.float32) if out is None else out
+        rows = self.materialized.rows(words)
+        missing = rows < 0
+        if self.metrics is not None:
+            self.metrics.incr(self.metrics_name + '.materialized_hit', int((~missing).sum()))
+        embs[~missing] = self.materialized.get(rows[~missing])
+        oov = np.zeros(len(words), dtype=bool)
+        if missing.any():
+            embs[missing], oov[missing] = self._batch([w for w, m in zip(words, missing) if m], f, None)
+        return embs, oov
+
+    def _batch(self, words, f, out):
+        words = list(words)
+        embs = np.empty((len(words), self.d_emb), dtype=np.float32) if out is None else out
+        blocks, start = [], 0
+        for e in self.embeddings:
+            blocks.append((e, embs[:, start:start+e.d_emb]))
+            start += e.d_emb
+        if not self.parallel or getattr(serial, 'active', False):
+            results = [f(e, words, block) for e, block in blocks]
+        else:
+            results = list(self.fanout_pool().map(lambda b: f(b[0], words, b[1]), blocks))
+        oov = np.zeros(len(words), dtype=bool)
+        for (e, block), (e_embs, e_oov) in zip(blocks, results):
+            if e_embs is not block:
+                block[:] = e_embs
+            oov |= e_oov
+        return embs, oov
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path, makedirs, remove, replace, environ
+
+import requests
+
+
+def default_download_workers():
+    """
+    Returns:
+        int: number of concurrent ranged requests per download, taken from ``$EMBEDDINGS_DOWNLOAD_WORKERS`` and defaulting to 4.
+    """
+    return int(environ.get('EMBEDDINGS_DOWNLOAD_WORKERS') or 4)
+
+
+def file_digest(fname, algorithm='sha256', chunk_size=1 << 20):
+    """
+
+    Args:
+        fname (str): file to hash.
+        algorithm (str): name of a ``hashlib`` algorithm.
+        chunk_size (int): number of bytes to read at a time.
+
+    Returns:
+        str: hex digest of the content of ``fname``.
+
+    """
+    h = hashlib.new(algorithm)
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def probe(url):
+    """
+
+    Returns:
+        tuple: the size of the resource at ``url``, or ``None`` if the server does not report it, and whether the server accepts byte ranges.
+    """
+    r = requests.head(url, allow_redirects=True, verify=False)
+    if not r.ok:
+        return None, False
+    size = r.headers.get('Content-Length')
+    return (int(size) if size else None), r.headers.get('Accept-Ranges', '').lower() == 'bytes'
+
+
+def fetch(url, f, start=0, end=None, chunk_size=1 << 20):
+    """
+    Writes the bytes ``start`` to ``end`` (inclusive) of the resource at ``url`` to ``f`` at its current position.
+
+    Returns:
+        int: number of bytes written, or ``-1`` if the server ignored the range and nothing was written.
+    """
+    headers = {}
+    if start or end is not None:
+        headers['Range'] = 'bytes={}-{}'.format(start, '' if end is None else end)
+    with requests.get(url, headers=headers, stream=True, verify=False) as r:
+        r.raise_for_status()
+        if headers and r.status_code != 206:
+            return -1
+        written = 0
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            f.write(chunk)
+            written += len(chunk)
+        return written
+
+
+def download(url, fname, sha256=None, size=None, workers=None, part_size=64 << 20, chunk_size=1 << 20, logger=logging.getLogger()):
+    """
+    Downloads ``url`` to ``fname`` so that ``fname`` only ever exists once it is complete and verified.
+
+    The content is written to ``<fname>.part``, which is renamed to ``fname`` once its size, and its SHA-256 if given, are checked.
+    If the server accepts byte ranges:
+
+    - files larger than ``part_size`` are downloaded as parts of ``part_size`` bytes by ``workers`` concurrent requests.
+      The finished parts are recorded in ``<fname>.part.json``, so an interrupted download only fetches the missing parts again.
+    - smaller files resume from the end of an existing ``<fname>.part``.
+
+    Args:
+        url (str): url to download from.
+        fname (str): file to download to.
+        sha256 (str): expected hex SHA-256 of the content, if known.
+        size (int): expected size in bytes. Defaults to the size reported by the server, if any.
+        workers (int): number of concurrent requests. Defaults to :func:`default_download_workers`.
+        part_size (int): number of bytes per concurrent request.
+        chunk_size (int): number of bytes read from the network at a time.
+        logger (logging.Logger): logger to log progress.
+
+    Returns:
+        str: ``fname``.
+
+    """
+    if path.dirname(fname) and not path.isdir(path.dirname(fname)):
+        makedirs(path.dirname(fname))
+    workers = workers or default_download_workers()
+    tmp, state = fname + '.part', fname + '.part.json'
+    remote_size, ranges = probe(url)
+    size = size if size is not None else remote_size
+
+    if ranges and size is not None and (path.isfile(state) or (workers > 1 and size > part_size and not path.isfile(tmp))):
+        download_parts(url, tmp, state, size, workers, part_size, chunk_size, logger)
+    else:
+        start = path.getsize(tmp) if ranges and path.isfile(tmp) else 0
+        if size is not None and start > size:
+            start = 0
+        if start:
+            logger.info('Resuming {} from byte {}'.format(fname, start))
+        if start != size:
+            with open(tmp, 'ab' if start else 'wb') as f:
+                if fetch(url, f, start=start, chunk_size=chunk_size) < 0:
+                    f.seek(0)
+                    f.truncate()
+                    fetch(url, f, chunk_size=chunk_size)
+
+    try:
+        actual = path.getsize(tmp)
+        if size is not None and actual != size:
+            raise IOError('{} has {} bytes, expected {}'.format(url, actual, size))
+        if sha256 is not None and file_digest(tmp) != sha256.lower():
+            raise IOError('{} does not match the expected SHA-256 {}'.format(url, sha256))
+    except IOError:
+        for f in [tmp, state]:
+            if path.isfile(f):
+                remove(f)
+        raise
+    replace(tmp, fname)
+    if path.isfile(state):
+        remove(state)
+    return fname
+
+
+def download_parts(url, tmp, state, size, workers, part_size, chunk_size, logger):
+    """
+    Downloads the parts of ``url`` that ``state`` does not record as done into ``tmp``, with ``workers`` concurrent ranged requests.
+    """
+    done = set()
+    if path.isfile(state) and path.isfile(tmp) and path.getsize(tmp) == size:
+        with open(state) as f:
+            saved = json.load(f)
+        if saved.get('size') == size and saved.get('part_size') == part_size:
+            done = set(saved['done'])
+    lock = threading.Lock()
+
+    def save():
+        with open(state + '.tmp', 'w') as f:
+            json.dump(dict(size=size, part_size=part_size, done=sorted(done)), f)
+        replace(state + '.tmp', state)
+
+    if not done:
+        with open(tmp, 'wb') as f:
+            f.truncate(size)
+        # the state is saved before any part, since the preallocated file alone would look complete
+        save()
+    starts = [s for s in range(0, size, part_size) if s not in done]
+    if done:
+        logger.info('Resuming {} with {} of {} parts left'.format(tmp, len(starts), len(starts) + len(done)))
+
+    def part(start):
+        end = min(start + part_size, size) - 1
+        with open(tmp, 'r+b') as f:
+            f.seek(start)
+            written = fetch(url, f, start=start, end=end, chunk_size=chunk_size)
+        if written != end - start + 1:
+            raise IOError('{} returned {} bytes for range {}-{}'.format(url, written, start, end))
+        with lock:
+            done.add(start)
+            save()
+
+    with ThreadPoolExecutor(workers) as executor:
+        for _ in executor.map(part, starts):
+            pass
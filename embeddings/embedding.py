@@ -1,13 +1,63 @@
 import sqlite3
-from os import path, makedirs, environ
-import requests
+import threading
+from os import path, makedirs, environ, remove, access, W_OK
 import logging
+import numpy as np
+import shutil
+import tempfile
 from array import array
-from io import StringIO
+from urllib.parse import quote
+from contextlib import contextmanager
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+from embeddings.matrix import MatrixStore, MatrixWriter
+from embeddings.cache import LRUCache
+from embeddings.metrics import Metrics
+from embeddings.oov import hash_vector
+from embeddings.pool import ReaderPool
+from embeddings.ingest import parse_line, parse_lines
+from embeddings.similarity import normalize, search
+from embeddings.ann import IVFIndex
 
 
 class Embedding:
 
+    d_emb = None
+    default = 'none'
+    # whether ``lookup`` and ``emb`` return float32 ``numpy.ndarray`` instead of lists by default.
+    as_numpy = False
+    # memory-mapped matrix store, used instead of the SQLite database when the ``mmap`` backend is selected.
+    matrix = None
+    matrix_writer = None
+    # optional LRU cache in front of ``lookup``, see ``enable_cache``.
+    cache = None
+    # optional LRU cache of the vectors of out of vocabulary words for the ``hash`` default, see ``enable_cache``.
+    oov_cache = None
+    # seed of the vectors of out of vocabulary words for the ``hash`` default, see ``hash_emb``.
+    hash_seed = 0
+    # whether inserts are part of the single transaction opened by ``bulk_load``.
+    bulk_loading = False
+    # version of the database schema recorded by ``mark_complete``. Databases built with another version are rebuilt.
+    schema_version = 1
+    # SQLite's default page cache size, in negative kibibytes.
+    default_cache_size = -2000
+    # L2 normalized copy of the embeddings used for similarity search, see ``normalized``.
+    normalized_matrix = None
+    # approximate nearest neighbour index over ``normalized_matrix``, see ``ann``.
+    ann_index = None
+    # optional counters and latency histograms, recorded under ``<metrics_name>.<event>``, see ``enable_metrics``.
+    metrics = None
+    metrics_name = None
+    # location of the store without its extension, next to which subsets are kept, see ``subset``.
+    store_root = None
+    # read-only connections used by ``reader``, see ``serve``.
+    pool = None
+    # executor of the async API, see ``async_pool``.
+    async_executor = None
+    async_workers = 4
+    # SQLite limits the number of host parameters in a single statement (999 on older builds).
+    max_query_size = 900
+
     @staticmethod
     def path(p):
         """
@@ -28,30 +78,29 @@ class Embedding:
         return path.join(path.abspath(root), p)
 
     @staticmethod
-    def download_file(url, local_filename):
+    def download_file(url, local_filename, sha256=None, size=None):
         """
         Downloads a file from an url to a local file.
 
+        The file is downloaded to a temporary file that is renamed once complete, with parallel ranged requests for large files, and
+        resumed if a previous download was interrupted. See :func:`embeddings.download.download`.
+
         Args:
             url (str): url to download from.
             local_filename (str): local file to download to.
+            sha256 (str): expected hex SHA-256 of the file, if known.
+            size (int): expected size of the file in bytes. Defaults to the size reported by the server.
 
         Returns:
             str: file name of the downloaded file.
 
         """
-        r = requests.get(url, stream=True, verify=False)
-        if path.dirname(local_filename) and not path.isdir(path.dirname(local_filename)):
-            raise Exception(local_filename)
-            makedirs(path.dirname(local_filename))
-        with open(local_filename, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024):
-                if chunk:
-                    f.write(chunk)
-        return local_filename
+        # the network stack is only imported when something needs to be downloaded
+        from embeddings.download import download
+        return download(url, local_filename, sha256=sha256, size=size)
 
     @staticmethod
-    def ensure_file(name, url=None, force=False, logger=logging.getLogger(), postprocess=None):
+    def ensure_file(name, url=None, force=False, logger=logging.getLogger(), postprocess=None, sha256=None, size=None):
         """
         Ensures that the file requested exists in the cache, downloading it if it does not exist.
 
@@ -61,16 +110,21 @@ class Embedding:
             force (bool): whether to force the download, regardless of the existence of the file.
             logger (logging.Logger): logger to log results.
             postprocess (function): a function that, if given, will be applied after the file is downloaded. The function has the signature ``f(fname)``
+            sha256 (str): expected hex SHA-256 of the downloaded file, if known.
+            size (int): expected size of the downloaded file in bytes.
 
         Returns:
             str: file name of the downloaded file.
 
+        Note:
+            Downloads are only renamed to ``name`` once complete and verified, so an interrupted download is never mistaken for the file.
+
         """
         fname = Embedding.path(name)
         if not path.isfile(fname) or force:
             if url:
                 logger.critical('Downloading from {} to {}'.format(url, fname))
-                Embedding.download_file(url, fname)
+                Embedding.download_file(url, fname, sha256=sha256, size=size)
                 if postprocess:
                     postprocess(fname)
             else:
@@ -86,28 +140,65 @@ class Embedding:
 
         Returns:
             db (sqlite3.Connection): a SQLite3 database with an embeddings table.
+            An existing database that is not writable, such as one on a read-only image, is opened read-only and left unchanged.
 
         """
+        if path.isfile(fname) and not access(fname, W_OK):
+            db = sqlite3.connect('file:{}?mode=ro'.format(quote(path.abspath(fname))), uri=True, isolation_level=None, check_same_thread=False)
+            # marks the connection as read-only for ``read_only``
+            db.execute('pragma query_only = 1')
+            return db
         if path.dirname(fname) and not path.isdir(path.dirname(fname)):
             makedirs(path.dirname(fname))
         # open database in autocommit mode by setting isolation_level to None.
-        db = sqlite3.connect(fname, isolation_level=None)
+        # connections may be handed to worker threads, such as those of ``ConcatEmbedding``, but are never used by two threads at once.
+        db = sqlite3.connect(fname, isolation_level=None, check_same_thread=False)
         c = db.cursor()
         c.execute('create table if not exists embeddings(word text primary key, emb blob)')
+        # build metadata, see ``mark_complete``.
+        c.execute('create table if not exists metadata(key text primary key, value text)')
         return db
 
+    def load_matrix(self, dname, show_progress=True, quantization='float32'):
+        """
+        Opens the memory-mapped matrix store at ``dname``, building it with ``load_word2emb`` if it is not complete.
+
+        Args:
+            dname (str): directory of the store. Quantized stores are kept apart in ``<dname>.<quantization>``.
+            show_progress (bool): whether to print progress while building the store.
+            quantization (str): how to store the embeddings. One of ``float32``, ``float16``, ``int8`` or ``pq``.
+
+        """
+        if quantization != 'float32':
+            dname = '{}.{}'.format(dname, quantization)
+        if not MatrixStore.exists(dname):
+            self.matrix_writer = MatrixWriter(dname, self.d_emb, quantization=quantization)
+            try:
+                with self.matrix_writer:
+                    self.load_word2emb(show_progress=show_progress)
+            finally:
+                self.matrix_writer = None
+        self.matrix = MatrixStore(dname)
+
     def load_memory(self):
-        # Read database to tempfile
-        tempfile = StringIO()
-        for line in self.db.iterdump():
-            tempfile.write('%s\n' % line)
-        self.db.close()
-        tempfile.seek(0)
+        """
+        Moves the embeddings into memory.
 
-        # Create a database in memory and import from tempfile
+        The database is copied page by page into an in-memory database with the SQLite backup API, so no SQL is generated or parsed.
+        A memory-mapped matrix store is read into dense in-memory arrays instead.
+
+        """
+        if self.matrix is not None:
+            self.matrix.load_memory()
+            return
         # open database in autocommit mode by setting isolation_level to None.
-        self.db = sqlite3.connect(":memory:", isolation_level=None)
-        self.db.cursor().executescript(tempfile.read())
+        db = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+        self.db.backup(db)
+        self.db.close()
+        self.db = db
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
         self.db.row_factory = sqlite3.Row
 
     def __len__(self):
@@ -115,11 +206,79 @@ class Embedding:
 
         Returns:
             count (int): number of embeddings in the database.
+            This is read from the metadata recorded by ``mark_complete``, unless embeddings were inserted since.
+
+        """
+        if self.matrix is not None:
+            return len(self.matrix)
+        size = self.metadata().get('size')
+        return int(size) if size is not None else self.count()
 
+    def count(self):
         """
+
+        Returns:
+            int: number of embeddings in the database, counted by scanning it.
+
+        """
+        return self.db.cursor().execute('select count(*) from embeddings').fetchone()[0]
+
+    def metadata(self):
+        """
+
+        Returns:
+            dict: the build metadata of the database, as strings. Empty if the database was never completely built.
+
+        """
+        if self.read_only() and not self.db.execute("select count(*) from sqlite_master where name = 'metadata'").fetchone()[0]:
+            # read-only databases built before the metadata table existed
+            return {}
+        return {k: v for k, v in self.db.cursor().execute('select key, value from metadata')}
+
+    def read_only(self):
+        """
+
+        Returns:
+            bool: whether the database was opened read-only by ``initialize_db``, because its file is not writable.
+
+        """
+        return bool(self.db.execute('pragma query_only').fetchone()[0])
+
+    def mark_complete(self, url=None, **extra):
+        """
+        Records that the database is completely built, along with the number of embeddings, their dimensions, the url they were
+        downloaded from and the version of the schema. Constructors then check ``is_complete`` instead of counting the embeddings.
+
+        Args:
+            url (str): url the embeddings were downloaded from.
+            extra: other metadata to record, such as the store a subset was built from.
+
+        """
+        meta = dict(extra, complete='1', size=self.count(), d_emb=self.d_emb, url=url, schema_version=self.schema_version)
         c = self.db.cursor()
-        q = c.execute('select count(*) from embeddings')
-        return q.fetchone()[0]
+        c.execute('begin')
+        c.executemany('insert or replace into metadata values (?, ?)', [(k, None if v is None else str(v)) for k, v in meta.items()])
+        c.execute('commit')
+
+    def is_complete(self, size=None):
+        """
+
+        Args:
+            size (int): expected number of embeddings. Databases built before the metadata table existed are considered complete if they hold at
+                least this many, in which case their metadata is recorded so that the count is not needed again, unless they are read-only.
+
+        Returns:
+            bool: whether the database was completely built with the current schema.
+
+        """
+        meta = self.metadata()
+        if meta:
+            return meta.get('complete') == '1' and meta.get('schema_version') == str(self.schema_version)
+        if size is not None and self.count() >= size:
+            if not self.read_only():
+                self.mark_complete()
+            return True
+        return False
 
     def insert_batch(self, batch):
         """
@@ -139,16 +298,112 @@ class Embedding:
                 ('!', [3, 4, 5]),
             ])
         """
+        self.insert_binary_batch([(word, array('f', emb).tobytes()) for word, emb in batch])
+
+    def insert_binary_batch(self, batch, ignore_existing=False):
+        """
+
+        Args:
+            batch (list): a list of embeddings to insert, each of which is a tuple ``(word, bytes)`` where ``bytes`` holds the float32 embeddings.
+            ignore_existing (bool): whether to skip words that already exist instead of failing, so that the first occurrence wins.
+
+        """
+        if self.cache is not None:
+            self.cache.clear()
+        self.normalized_matrix = self.ann_index = None
+        if self.matrix_writer is not None:
+            self.matrix_writer.insert_binary_batch(batch)
+            return
         c = self.db.cursor()
-        binarized = [(word, array('f', emb).tobytes()) for word, emb in batch]
+        sql = "insert or ignore into embeddings values (?, ?)" if ignore_existing else "insert into embeddings values (?, ?)"
+        # the recorded size no longer holds, so ``__len__`` counts again
+        invalidate = "delete from metadata where key = 'size'"
+        if self.bulk_loading:
+            c.executemany(sql, batch)
+            c.execute(invalidate)
+            return
         try:
             c.execute("BEGIN TRANSACTION;")
-            c.executemany("insert into embeddings values (?, ?)", binarized)
+            c.executemany(sql, batch)
+            c.execute(invalidate)
             c.execute("COMMIT;")
         except Exception as e:
             print('insert failed\n{}'.format([w for w, e in batch]))
             raise e
 
+    def ingest(self, lines, parse=parse_line, batch_size=1000, workers=None):
+        """
+        Parses the lines of an embedding file in parallel and inserts the embeddings. Only the first occurrence of each word is kept.
+
+        Args:
+            lines (iterable): lines of the embedding file, as bytes.
+            parse (function): a module level function with the signature ``f(line, d_emb)`` that returns ``(word, bytes)``.
+            batch_size (int): number of lines to parse and insert at a time.
+            workers (int): number of processes to parse with. Defaults to ``$EMBEDDINGS_WORKERS`` or the number of cores.
+
+        Note:
+            Duplicates are resolved by the store rather than by tracking the vocabulary in memory:
+            the primary key of the database ignores later occurrences, as does the index of the matrix store.
+        """
+        m = self.metrics
+        with self.bulk_load():
+            start = perf_counter()
+            for batch in parse_lines(lines, parse, self.d_emb, batch_size=batch_size, workers=workers):
+                self.insert_binary_batch(batch, ignore_existing=True)
+                if m is not None:
+                    # the time of a batch includes waiting for it to be parsed
+                    m.observe(self.metrics_name + '.ingest_batch', perf_counter() - start)
+                    m.incr(self.metrics_name + '.ingest_rows', len(batch))
+                    start = perf_counter()
+
+    @contextmanager
+    def bulk_load(self, cache_mb=1024):
+        """
+        Tunes the database for loading many embeddings at once.
+
+        Within the context, durability is relaxed, the page cache is enlarged so that the primary key index stays in memory,
+        and every insert is part of a single transaction that is committed on exit and rolled back on error.
+        On exit, the database is switched back to a rollback journal, which readers can open from read-only media.
+        The schema is unchanged.
+
+        Args:
+            cache_mb (int): size of the page cache during the load, in megabytes.
+
+        Example:
+
+        .. code-block:: python
+
+            with e.bulk_load():
+                e.insert_batch(batch1)
+                e.insert_batch(batch2)
+        """
+        if self.matrix_writer is not None or self.bulk_loading:
+            yield
+            return
+        c = self.db.cursor()
+        c.execute('pragma journal_mode=memory')
+        c.execute('pragma synchronous=off')
+        c.execute('pragma temp_store=memory')
+        c.execute('pragma cache_size=-{}'.format(cache_mb * 1024))
+        c.execute('pragma locking_mode=exclusive')
+        c.execute('begin transaction')
+        self.bulk_loading = True
+        try:
+            yield
+            c.execute('commit')
+        except BaseException:
+            c.execute('rollback')
+            raise
+        finally:
+            self.bulk_loading = False
+            c.execute('pragma cache_size={}'.format(self.default_cache_size))
+            c.execute('pragma journal_mode=delete')
+            c.execute('pragma synchronous=full')
+            c.execute('pragma temp_store=default')
+            c.execute('pragma locking_mode=normal')
+            # the exclusive lock is only released by the next access to the database
+            c.execute('select count(*) from sqlite_master')
+
     def __contains__(self, w):
         """
 
@@ -159,7 +414,7 @@ class Embedding:
             whether an embedding for ``w`` exists.
 
         """
-        return self.lookup(w) is not None
+        return self.lookup(w, as_numpy=True) is not None
 
     def clear(self):
         """
@@ -167,20 +422,776 @@ class Embedding:
         Deletes all embeddings from the database.
 
         """
+        if self.cache is not None:
+            self.cache.clear()
+        self.normalized_matrix = self.ann_index = None
         c = self.db.cursor()
+        c.execute('delete from metadata')
         c.execute('delete from embeddings')
 
-    def lookup(self, w):
+    def enable_cache(self, maxsize=100000, oov_maxsize=0):
+        """
+        Caches the results of ``lookup`` in memory, including words that do not exist.
+
+        Args:
+            maxsize (int): maximum number of words to cache. The least recently used words are evicted first.
+            oov_maxsize (int): maximum number of out of vocabulary words whose ``hash`` default vectors to cache. ``0`` disables this cache.
+
+        Returns:
+            LRUCache: the cache, whose ``stats`` method reports hits, misses and evictions.
+
+        """
+        self.cache = LRUCache(maxsize)
+        self.oov_cache = LRUCache(oov_maxsize) if oov_maxsize else None
+        return self.cache
+
+    def disable_cache(self):
+        """
+        Removes the caches in front of ``lookup`` and ``hash_emb``.
+        """
+        self.cache = self.oov_cache = None
+
+    def enable_metrics(self, metrics=None, name=None):
+        """
+        Records counters and latency histograms of lookups, out of vocabulary words, cache hits and ingested batches.
+
+        Recording takes a lock and a clock read per call, which is small next to a lookup, and nothing at all while metrics are disabled.
+        The events recorded, under ``<name>.<event>``, are:
+
+        - ``lookup``: latency of ``lookup``, also called by ``emb``. ``lookup_oov`` counts the words that do not exist.
+        - ``cache_hit`` and ``cache_miss``: lookups answered and not answered by the cache of ``enable_cache``.
+        - ``lookup_batch`` and ``emb_batch``: latency of batch calls. ``lookup_batch_words``, ``lookup_batch_oov`` and ``emb_batch_words``
+          count the words.
+        - ``oov_default``: words embedded with the default of ``emb`` or ``emb_batch``.
+        - ``ingest_batch``: time to parse and insert each batch while building the store. ``ingest_rows`` counts the embeddings.
+
+        Args:
+            metrics (Metrics): where to record. Defaults to a new ``Metrics``, and can be shared between embeddings.
+            name (str): prefix of the recorded names. Defaults to the name of the class.
+
+        Returns:
+            Metrics: the metrics, whose ``snapshot`` method returns every counter and histogram.
+
+        """
+        self.metrics = metrics or Metrics()
+        self.metrics_name = name or type(self).__name__
+        return self.metrics
+
+    def disable_metrics(self):
+        """
+        Stops recording metrics.
+        """
+        self.metrics = None
+
+    def lookup(self, w, as_numpy=None):
         """
 
         Args:
             w: word to look up.
+            as_numpy (bool): whether to return a read-only float32 ``numpy.ndarray`` over the stored bytes instead of a list. Defaults to ``self.as_numpy``.
 
         Returns:
             embeddings for ``w``, if it exists.
             ``None``, otherwise.
 
         """
-        c = self.db.cursor()
+        if as_numpy is None:
+            as_numpy = self.as_numpy
+        m = self.metrics
+        if m is not None:
+            start = perf_counter()
+        if self.cache is None:
+            e = self._lookup(w)
+        else:
+            hit, e = self.cache.get(w)
+            if not hit:
+                e = self._lookup(w)
+                self.cache.put(w, e)
+            if m is not None:
+                m.incr(self.metrics_name + ('.cache_hit' if hit else '.cache_miss'))
+        if m is not None:
+            m.observe(self.metrics_name + '.lookup', perf_counter() - start)
+            if e is None:
+                m.incr(self.metrics_name + '.lookup_oov')
+        if e is None or as_numpy:
+            return e
+        return e.tolist()
+
+    def _lookup(self, w):
+        """
+
+        Returns:
+            numpy.ndarray: a read-only float32 view of the embeddings for ``w``, if it exists.
+            ``None``, otherwise.
+
+        """
+        if self.matrix is not None:
+            e = self.matrix.lookup(w)
+            if e is not None:
+                e.flags.writeable = False
+            return e
+        c = self.reader().cursor()
         q = c.execute('select emb from embeddings where word = :word', {'word': w}).fetchone()
-        return array('f', q[0]).tolist() if q else None
+        # databases built before header lines were skipped at ingest hold them as shorter entries
+        if q is None or (self.d_emb is not None and len(q[0]) != 4 * self.d_emb):
+            return None
+        return np.frombuffer(q[0], dtype=np.float32)
+
+    def emb(self, word, default=None, as_numpy=None):
+        """
+
+        Args:
+            word: word to embed.
+            default (str): how to embed words that are out of vocabulary. Defaults to ``self.default``.
+            as_numpy (bool): whether to return a float32 ``numpy.ndarray`` instead of a list. Defaults to ``self.as_numpy``.
+
+        Returns:
+            embeddings for ``word``, or the default embeddings if it does not exist.
+
+        """
+        if default is None:
+            default = self.default
+        if as_numpy is None:
+            as_numpy = self.as_numpy
+        e = self.lookup(word, as_numpy=as_numpy)
+        if e is not None:
+            return e
+        if self.metrics is not None:
+            self.metrics.incr(self.metrics_name + '.oov_default')
+        return self.default_emb(default, as_numpy=as_numpy, word=word)
+
+    def default_emb(self, default, as_numpy=False, word=None):
+        """
+
+        Args:
+            default (str): one of ``none``, ``zero``, ``random`` or ``hash``.
+            as_numpy (bool): whether to return a float32 ``numpy.ndarray`` instead of a list.
+            word (str): the word that is out of vocabulary, which is required for ``hash``.
+
+        Returns:
+            embeddings for a word that is out of vocabulary. For ``none``, a list of ``None``, or ``None`` itself if ``as_numpy`` is set.
+
+        """
+        if default == 'none':
+            return None if as_numpy else [None] * self.d_emb
+        if default == 'zero':
+            e = np.zeros(self.d_emb, dtype=np.float32)
+        elif default == 'hash':
+            e = self.hash_emb(word)
+        else:
+            e = np.random.uniform(-0.1, 0.1, self.d_emb).astype(np.float32)
+        return e if as_numpy else e.tolist()
+
+    def hash_emb(self, word):
+        """
+        Embeds an out of vocabulary word for the ``hash`` default.
+        The vector is derived from a hash of ``word`` and ``hash_seed``, so it is the same on every call and in every process.
+
+        Args:
+            word (str): word to embed.
+
+        Returns:
+            numpy.ndarray: read-only float32 vector in ``[-0.1, 0.1)``, memoized if ``enable_cache`` was called with ``oov_maxsize``.
+
+        """
+        if self.oov_cache is not None:
+            hit, e = self.oov_cache.get(word)
+            if hit:
+                return e
+        e = hash_vector(word, self.d_emb, seed=self.hash_seed)
+        e.flags.writeable = False
+        if self.oov_cache is not None:
+            self.oov_cache.put(word, e)
+        return e
+
+    def lookup_batch(self, words, out=None):
+        """
+
+        Args:
+            words (list): words to look up.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into, such as a slice of a larger array.
+
+        Returns:
+            tuple: a float32 ``numpy.ndarray`` of shape ``(len(words), d_emb)`` containing the embeddings for ``words``,
+            and a boolean ``numpy.ndarray`` of shape ``(len(words),)`` that is ``True`` for words that do not exist.
+            Rows for words that do not exist are zero.
+
+        """
+        words = list(words)
+        if self.metrics is not None:
+            start = perf_counter()
+            embs, oov = self._lookup_batch(words, out)
+            self.record_batch('lookup_batch', start, len(words), int(oov.sum()))
+            return embs, oov
+        return self._lookup_batch(words, out)
+
+    def _lookup_batch(self, words, out):
+        if self.matrix is not None:
+            return self.matrix.lookup_batch(words, out=out)
+        found = self._fetch_batch(words)
+        d_emb = self.d_emb
+        if d_emb is None:
+            d_emb = max(len(blob) for blob in found.values()) // 4 if found else 0
+        if out is None:
+            embs = np.zeros((len(words), d_emb), dtype=np.float32)
+        else:
+            embs = out
+            embs[:] = 0
+        oov = np.ones(len(words), dtype=bool)
+        rows, blobs = [], []
+        for i, w in enumerate(words):
+            blob = found.get(w)
+            # entries whose dimensions differ, such as header lines, are out of vocabulary as in ``iter_embeddings``
+            if blob is not None and len(blob) == 4 * d_emb:
+                rows.append(i)
+                blobs.append(blob)
+        if rows:
+            embs[rows] = np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(rows), d_emb)
+            oov[rows] = False
+        return embs, oov
+
+    def emb_batch(self, words, default=None, out=None):
+        """
+
+        Args:
+            words (list): words to embed.
+            default (str): how to embed words that are out of vocabulary. Defaults to ``self.default``.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into.
+
+        Returns:
+            tuple: a float32 ``numpy.ndarray`` of shape ``(len(words), d_emb)`` and a boolean out of vocabulary mask.
+
+        Note:
+            Since a matrix cannot hold ``None``, the ``none`` default fills out of vocabulary rows with ``nan``.
+        """
+        if default is None:
+            default = getattr(self, 'default', 'none')
+        if self.metrics is not None:
+            start = perf_counter()
+        embs, oov = self.lookup_batch(words, out=out)
+        self.fill_default(embs, oov, default, words=words)
+        if self.metrics is not None:
+            self.record_batch('emb_batch', start, len(embs), int(oov.sum()), oov_event='oov_default')
+        return embs, oov
+
+    def record_batch(self, event, start, n_words, n_oov, oov_event=None):
+        """
+        Records the latency of a batch call that started at ``start``, the number of words in it and how many of them are out of vocabulary.
+
+        Args:
+            event (str): name of the call.
+            start (float): ``time.perf_counter()`` at the start of the call.
+            n_words (int): number of words in the batch.
+            n_oov (int): number of out of vocabulary words in the batch.
+            oov_event (str): name of the counter of out of vocabulary words. Defaults to ``<event>_oov``.
+
+        """
+        m, name = self.metrics, self.metrics_name
+        m.observe('{}.{}'.format(name, event), perf_counter() - start)
+        m.incr('{}.{}_words'.format(name, event), n_words)
+        if n_oov:
+            m.incr('{}.{}'.format(name, oov_event or event + '_oov'), n_oov)
+
+    def fill_default(self, embs, oov, default, words=None):
+        """
+        Fills the rows of ``embs`` marked by ``oov`` in place according to ``default``.
+
+        Args:
+            embs (numpy.ndarray): float32 matrix of embeddings.
+            oov (numpy.ndarray): boolean mask of rows to fill.
+            default (str): one of ``none``, ``zero``, ``random`` or ``hash``.
+            words (list): the words of the rows of ``embs``, which are required for ``hash``.
+
+        """
+        assert default in {'none', 'random', 'zero', 'hash'}
+        if not oov.any():
+            return
+        if default == 'none':
+            embs[oov] = np.nan
+        elif default == 'zero':
+            embs[oov] = 0.
+        elif default == 'hash':
+            for i in np.flatnonzero(oov):
+                embs[i] = self.hash_emb(words[i])
+        else:
+            embs[oov] = np.random.uniform(-0.1, 0.1, (int(oov.sum()), embs.shape[1]))
+
+    def _fetch_batch(self, words, table='embeddings'):
+        """
+
+        Args:
+            words (list): words to look up.
+            table (str): table to look the words up in.
+
+        Returns:
+            dict: a mapping from each word in ``words`` that exists to its stored embedding blob.
+
+        """
+        c = self.reader().cursor()
+        unique = list(dict.fromkeys(words))
+        found = {}
+        for i in range(0, len(unique), self.max_query_size):
+            chunk = unique[i:i+self.max_query_size]
+            q = c.execute('select word, emb from {} where word in ({})'.format(table, ','.join('?' * len(chunk))), chunk)
+            found.update(q.fetchall())
+        return found
+
+    def iter_embeddings(self, batch_size=10000):
+        """
+        Iterates over every embedding in the store. Entries whose dimensions differ from ``d_emb``, such as header lines, are skipped.
+
+        Args:
+            batch_size (int): number of embeddings per batch.
+
+        Returns:
+            generator: tuples ``(words, embs)`` where ``embs`` is a ``(len(words), d_emb)`` float32 matrix.
+
+        """
+        if self.matrix is not None:
+            rows = self.matrix.valid_rows()
+            for i in range(0, len(rows), batch_size):
+                chunk = rows[i:i+batch_size]
+                yield [self.matrix.word(r) for r in chunk], self.matrix.get(chunk)
+            return
+        d_emb = self.d_emb
+        c = self.db.cursor()
+        q = c.execute('select word, emb from embeddings')
+        while True:
+            rows = q.fetchmany(batch_size)
+            if not rows:
+                break
+            if d_emb is None:
+                d_emb = len(rows[0][1]) // 4
+            rows = [(w, e) for w, e in rows if len(e) == 4 * d_emb]
+            if rows:
+                yield [w for w, e in rows], np.frombuffer(b''.join(e for w, e in rows), dtype=np.float32).reshape(len(rows), d_emb)
+
+    def store_path(self):
+        """
+
+        Returns:
+            str: location of the database or matrix store on disk, or ``None`` if the embeddings are in memory.
+
+        """
+        if self.matrix is not None:
+            return self.matrix.dname
+        return self.db.execute('pragma database_list').fetchone()[2] or None
+
+    def subset_path(self, name, backend='sqlite', quantization='float32'):
+        """
+
+        Args:
+            name (str): name of the subset.
+            backend (str): how the subset is stored, ``sqlite`` or ``mmap``.
+            quantization (str): how the embeddings of a ``mmap`` subset are encoded.
+
+        Returns:
+            str: location of the subset ``name``, next to the full store.
+
+        """
+        assert self.store_root is not None, 'subsets are only kept for embeddings with a known store location'
+        assert backend in {'sqlite', 'mmap'}
+        if backend == 'sqlite':
+            return '{}.{}.db'.format(self.store_root, name)
+        fname = '{}.{}.mmap'.format(self.store_root, name)
+        return fname if quantization == 'float32' else '{}.{}'.format(fname, quantization)
+
+    def subset_keys(self, words):
+        """
+
+        Args:
+            words (iterable): words to embed.
+
+        Returns:
+            generator: the entries of the store needed to embed ``words``, each once.
+
+        """
+        seen = set()
+        for w in words:
+            if w not in seen:
+                seen.add(w)
+                yield w
+
+    def subset(self, name, words=None, corpus=None, backend='sqlite', quantization='float32', batch_size=10000):
+        """
+        Builds a smaller store that only holds the embeddings of a vocabulary, which the constructor opens in place of the full store
+        when given ``subset=name``. The full store is no longer needed once the subset is built.
+
+        The vocabulary is streamed through in batches of ``batch_size`` words, which are looked up together and written in bulk.
+        Words that are not in the full store are left out, so that they get the default embedding of the subset.
+
+        Args:
+            name (str): name of the subset.
+            words (iterable): vocabulary of the subset.
+            corpus (str): text file whose whitespace separated tokens are the vocabulary of the subset, instead of ``words``.
+            backend (str): how to store the subset. Can use a ``sqlite`` database or a memory-mapped ``mmap`` matrix.
+            quantization (str): how to encode the embeddings in a ``mmap`` subset. Can use ``float32``, ``float16``, ``int8`` or ``pq``.
+            batch_size (int): number of words to look up at a time.
+
+        Returns:
+            str: location of the subset.
+
+        Example:
+
+        .. code-block:: python
+
+            GloveEmbedding('common_crawl_840').subset('service', corpus='queries.txt')
+            g = GloveEmbedding('common_crawl_840', subset='service')
+
+        """
+        assert (words is None) != (corpus is None), 'either words or corpus is required'
+        assert quantization == 'float32' or backend == 'mmap', 'quantization requires the mmap backend'
+        fname = self.subset_path(name, backend=backend, quantization=quantization)
+        source = self.store_path()
+        if corpus is not None:
+            with open(corpus, encoding='utf-8') as f:
+                return self.subset(name, words=(w for line in f for w in line.split()), backend=backend, quantization=quantization, batch_size=batch_size)
+
+        batches = self._subset_batches(self.subset_keys(words), batch_size)
+        if backend == 'mmap':
+            with MatrixWriter(fname, self.d_emb, meta=dict(source=source, subset=name), quantization=quantization) as writer:
+                for keys, embs in batches:
+                    writer.insert_matrix(keys, embs)
+            return fname
+        if path.isfile(fname):
+            remove(fname)
+        target = Embedding()
+        target.d_emb = self.d_emb
+        target.db = self.initialize_db(fname)
+        try:
+            with target.bulk_load():
+                for keys, embs in batches:
+                    target.insert_binary_batch([(k, e.tobytes()) for k, e in zip(keys, embs)])
+            url = None if self.matrix is not None else self.metadata().get('url')
+            target.mark_complete(url=url, source=source, subset=name)
+        finally:
+            target.db.close()
+        return fname
+
+    def _subset_batches(self, keys, batch_size):
+        batch = []
+        for k in keys:
+            batch.append(k)
+            if len(batch) == batch_size:
+                yield self._subset_batch(batch)
+                batch = []
+        if batch:
+            yield self._subset_batch(batch)
+
+    def _subset_batch(self, keys):
+        embs, oov = self.lookup_batch(keys)
+        return [k for k, o in zip(keys, oov) if not o], embs[~oov]
+
+    def open_subset(self, name, backend='sqlite', quantization='float32'):
+        """
+        Opens the subset ``name`` built by ``subset`` instead of the full store.
+
+        Args:
+            name (str): name of the subset.
+            backend (str): how the subset is stored, ``sqlite`` or ``mmap``.
+            quantization (str): how the embeddings of a ``mmap`` subset are encoded.
+
+        """
+        fname = self.subset_path(name, backend=backend, quantization=quantization)
+        if backend == 'mmap':
+            if not MatrixStore.exists(fname):
+                raise IOError('{} does not exist! Build it with subset()'.format(fname))
+            self.matrix = MatrixStore(fname)
+            return
+        if not path.isfile(fname):
+            raise IOError('{} does not exist! Build it with subset()'.format(fname))
+        self.db = self.initialize_db(fname)
+        if not self.is_complete():
+            raise IOError('{} is incomplete! Build it again with subset()'.format(fname))
+
+    def normalized(self):
+        """
+        Returns the L2 normalized embeddings used for similarity search.
+
+        They are computed once and saved as a memory-mapped matrix store next to the embeddings, in ``<store>.norm``.
+        The saved copy is rebuilt if the store it was built from changed since, see ``source_version``.
+        Embeddings without a store on disk, such as those read by ``load_memory``, keep their normalized copy in memory only.
+
+        Returns:
+            MatrixStore: the normalized embeddings.
+
+        """
+        if self.normalized_matrix is None:
+            fname = self.store_path()
+            dname = fname + '.norm' if fname else tempfile.mkdtemp()
+            version = self.source_version()
+            if fname and MatrixStore.exists(dname):
+                store = MatrixStore(dname)
+                if store.meta.get('source') == version:
+                    self.normalized_matrix = store
+                    return store
+                store.close()
+            try:
+                with MatrixWriter(dname, self.d_emb, meta=dict(source_size=version['size'], source=version)) as writer:
+                    for words, embs in self.iter_embeddings():
+                        writer.d_emb = embs.shape[1]
+                        writer.insert_matrix(words, normalize(embs.copy()))
+                store = MatrixStore(dname)
+                if not fname:
+                    store.load_memory()
+            finally:
+                if not fname:
+                    shutil.rmtree(dname)
+            self.normalized_matrix = store
+        return self.normalized_matrix
+
+    def source_version(self):
+        """
+
+        Returns:
+            dict: the number of embeddings, the url and schema version recorded by ``mark_complete``, and the modification time of the
+            store on disk, which together identify the build of the store that copies such as ``normalized`` are derived from.
+
+        """
+        fname = self.store_path()
+        meta = {} if self.matrix is not None else self.metadata()
+        mtime = None
+        if fname:
+            mtime = path.getmtime(path.join(fname, 'meta.json') if self.matrix is not None else fname)
+        return dict(size=len(self), url=meta.get('url'), schema_version=meta.get('schema_version'), mtime=mtime)
+
+    def ann(self, n_lists=None, rebuild=False):
+        """
+        Returns the approximate nearest neighbour index used by ``most_similar`` when ``nprobe`` is given.
+
+        The index is built once from the normalized embeddings and saved next to the embeddings, in ``<store>.ivf``,
+        or kept in memory only if the normalized embeddings are.
+        Its ``meta['recall']`` records the recall@10 against exact search measured when it was built.
+
+        Args:
+            n_lists (int): number of inverted lists. Defaults to ``sqrt(len(self))``.
+            rebuild (bool): whether to rebuild the index even if it exists.
+
+        Returns:
+            IVFIndex: the index.
+
+        """
+        if self.ann_index is None or rebuild:
+            norm = self.normalized()
+            saved = norm.dname.endswith('.norm') and path.isdir(norm.dname)
+            dname = norm.dname[:-len('.norm')] + '.ivf' if saved else tempfile.mkdtemp()
+            meta = dict(source_size=norm.meta['source_size'], source=norm.meta.get('source'))
+            if saved and not rebuild and IVFIndex.exists(dname):
+                index = IVFIndex(dname)
+                if index.meta.get('source') == meta['source'] and n_lists in {None, index.meta['n_lists']}:
+                    self.ann_index = index
+                    return index
+            try:
+                index = IVFIndex.build(dname, norm.vectors, n_lists=n_lists, meta=meta)
+                if not saved:
+                    index.load_memory()
+            finally:
+                if not saved:
+                    shutil.rmtree(dname)
+            self.ann_index = index
+        return self.ann_index
+
+    def similarity(self, w1, w2):
+        """
+
+        Args:
+            w1 (str): first word.
+            w2 (str): second word.
+
+        Returns:
+            float: cosine similarity between the embeddings of ``w1`` and ``w2``, or ``None`` if either does not exist.
+
+        """
+        (e1, e2), oov = self.lookup_batch([w1, w2])
+        if oov.any():
+            return None
+        denom = np.linalg.norm(e1) * np.linalg.norm(e2)
+        return float(e1 @ e2 / denom) if denom else 0.
+
+    def most_similar(self, query, k=10, nprobe=None):
+        """
+
+        Args:
+            query: a word, or an embedding vector.
+            k (int): number of neighbours to return.
+            nprobe (int): if given, search approximately with the index from ``ann``, scanning ``nprobe`` of its lists.
+
+        Returns:
+            list: up to ``k`` tuples ``(word, cosine similarity)`` sorted by decreasing similarity, excluding the query word itself.
+            ``None`` if the query word does not exist.
+
+        """
+        return self.most_similar_batch([query], k=k, nprobe=nprobe)[0]
+
+    def most_similar_batch(self, queries, k=10, nprobe=None):
+        """
+        Finds nearest neighbours for many queries at once with blocked matrix multiplies over the normalized embeddings.
+
+        Args:
+            queries (list): words or embedding vectors.
+            k (int): number of neighbours to return per query.
+            nprobe (int): if given, search approximately with the index from ``ann``, scanning ``nprobe`` of its lists.
+
+        Returns:
+            list: the result of ``most_similar`` for each query.
+
+        """
+        norm = self.normalized()
+        vecs = np.zeros((len(queries), norm.d_emb), dtype=np.float32)
+        exclude = np.full(len(queries), -1, dtype=np.int64)
+        found = np.ones(len(queries), dtype=bool)
+        for i, q in enumerate(queries):
+            if isinstance(q, str):
+                r = norm.row(q)
+                if r < 0:
+                    found[i] = False
+                    continue
+                vecs[i] = norm.vectors[r]
+                exclude[i] = r
+            else:
+                vecs[i] = q
+        normalize(vecs)
+        results = [None] * len(queries)
+        if found.any():
+            if nprobe is None:
+                scores, rows = search(norm.vectors, vecs[found], k, exclude=exclude[found])
+            else:
+                scores, rows = zip(*self.ann().search(vecs[found], k, nprobe=nprobe, exclude=exclude[found]))
+            for i, s, r in zip(np.flatnonzero(found), scores, rows):
+                results[i] = [(norm.word(j), float(v)) for j, v in zip(r, s)]
+        return results
+
+    def serve(self, immutable=False, mmap_size=1 << 34):
+        """
+        Switches reads to read-only connections from a ``ReaderPool``, one per thread and per forked process.
+        The object can then be shared by many threads, and by processes forked after this call, without locking.
+
+        Writes still go through ``db``. In-memory databases and matrix stores have nothing to open, so this does nothing for them.
+
+        Args:
+            immutable (bool): whether to promise SQLite that the database is never written again, by any process, which skips locking.
+            mmap_size (int): number of bytes of the database to read through a memory map, see ``ReaderPool``.
+
+        Returns:
+            ReaderPool: the pool, or ``None`` if there is no database file.
+
+        """
+        fname = self.store_path() if self.matrix is None and getattr(self, 'db', None) is not None else None
+        if self.pool is not None:
+            self.pool.close()
+        self.pool = ReaderPool(fname, immutable=immutable, mmap_size=mmap_size) if fname else None
+        return self.pool
+
+    def reader(self):
+        """
+        Returns:
+            sqlite3.Connection: the connection to read from in the calling thread, which is ``db`` unless ``serve`` was called.
+        """
+        return self.db if self.pool is None else self.pool.get()
+
+    def readers(self):
+        """
+        Returns:
+            list: the read-only connections of the calling thread, which ``run_async`` interrupts on cancellation.
+        """
+        return [] if self.pool is None else [self.pool.get()]
+
+    def async_pool(self):
+        """
+        Returns the executor that runs ``alookup``, ``aemb`` and ``aemb_batch``, creating it on first use.
+
+        It has ``async_workers`` threads, so at most that many lookups run at once however many coroutines are waiting.
+        Unless ``serve`` was already called, it is called first, so that each thread reads with its own connection.
+
+        Returns:
+            concurrent.futures.ThreadPoolExecutor: the executor.
+
+        """
+        if self.async_executor is None:
+            if self.pool is None:
+                self.serve()
+            self.async_executor = ThreadPoolExecutor(self.async_workers, thread_name_prefix='embeddings')
+        return self.async_executor
+
+    def close_async(self):
+        """
+        Shuts down the executor of the async API. It is created again by the next async call.
+        """
+        if self.async_executor is not None:
+            self.async_executor.shutdown(wait=True)
+            self.async_executor = None
+
+    async def run_async(self, f, *args, timeout=None):
+        """
+        Runs ``f(*args)`` on the executor from ``async_pool`` without blocking the event loop.
+
+        If the call is cancelled or times out before it starts, it never runs. If it is already running, the queries of its thread are
+        interrupted, so that the thread is freed for the next call.
+
+        Args:
+            f (function): function to call.
+            args: arguments of ``f``.
+            timeout (float): seconds to wait for the result before raising ``asyncio.TimeoutError``. ``None`` waits indefinitely.
+
+        Returns:
+            the result of ``f``.
+
+        """
+        import asyncio
+        lock = threading.Lock()
+        running = []
+
+        def call():
+            with lock:
+                running.extend(self.readers())
+            try:
+                return f(*args)
+            finally:
+                with lock:
+                    running.clear()
+
+        future = asyncio.get_running_loop().run_in_executor(self.async_pool(), call)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except (asyncio.CancelledError, asyncio.TimeoutError):
+            with lock:
+                for db in running:
+                    db.interrupt()
+            raise
+
+    async def alookup(self, w, as_numpy=None, timeout=None):
+        """
+        Async version of ``lookup``.
+
+        Args:
+            w: word to look up.
+            as_numpy (bool): whether to return a float32 ``numpy.ndarray`` instead of a list.
+            timeout (float): seconds to wait before raising ``asyncio.TimeoutError``.
+
+        """
+        return await self.run_async(self.lookup, w, as_numpy, timeout=timeout)
+
+    async def aemb(self, word, default=None, as_numpy=None, timeout=None):
+        """
+        Async version of ``emb``.
+
+        Args:
+            word: word to embed.
+            default (str): how to embed words that are out of vocabulary.
+            as_numpy (bool): whether to return a float32 ``numpy.ndarray`` instead of a list.
+            timeout (float): seconds to wait before raising ``asyncio.TimeoutError``.
+
+        """
+        return await self.run_async(self.emb, word, default, as_numpy, timeout=timeout)
+
+    async def aemb_batch(self, words, default=None, timeout=None):
+        """
+        Async version of ``emb_batch``.
+
+        Args:
+            words (list): words to embed.
+            default (str): how to embed words that are out of vocabulary.
+            timeout (float): seconds to wait before raising ``asyncio.TimeoutError``.
+
+        """
+        return await self.run_async(self.emb_batch, list(words), default, timeout=timeout)
@@ -1,9 +1,6 @@
-import random
 from collections import namedtuple
 from os import path
 
-import zipfile
-from tqdm import tqdm
 from embeddings.embedding import Embedding
 
 
@@ -18,61 +15,54 @@ class FastTextEmbedding(Embedding):
     }
     d_emb = 300
 
-    def __init__(self, lang='en', show_progress=True, default='none'):
+    def __init__(self, lang='en', show_progress=True, default='none', backend='sqlite', quantization='float32', as_numpy=False, subset=None):
         """
 
         Args:
             lang (en): what language to use.
             show_progress (bool): whether to print progress.
             default (str): how to embed words that are out of vocabulary.
+            backend (str): how to store the embeddings. Can use a ``sqlite`` database or a memory-mapped ``mmap`` matrix.
+            quantization (str): how to encode the embeddings in a ``mmap`` matrix. Can use ``float32``, ``float16``, ``int8`` or product quantization with ``pq``.
+            as_numpy (bool): whether ``lookup`` and ``emb`` return float32 ``numpy.ndarray`` instead of lists.
+            subset (str): name of a subset built with ``subset`` to open instead of the full embeddings, with the ``backend`` and ``quantization`` it was built with.
 
         Note:
-            Default can use zeros, return ``None``, or generate random between ``[-0.1, 0.1]``.
+            Default can use zeros, return ``None``, generate random between ``[-0.1, 0.1]``, or ``hash`` the word into a vector in that range that is the same on every call.
         """
-        assert default in {'none', 'random', 'zero'}
+        assert default in {'none', 'random', 'zero', 'hash'}
+        assert backend in {'sqlite', 'mmap'}
+        assert quantization == 'float32' or backend == 'mmap', 'quantization requires the mmap backend'
 
         self.lang = lang
-        self.db = self.initialize_db(self.path(path.join('fasttext', '{}.db'.format(lang))))
         self.default = default
+        self.as_numpy = as_numpy
+        self.store_root = self.path(path.join('fasttext', lang))
+
+        if subset is not None:
+            self.open_subset(subset, backend=backend, quantization=quantization)
+            return
+        if backend == 'mmap':
+            self.load_matrix(self.path(path.join('fasttext', '{}.mmap'.format(lang))), show_progress=show_progress, quantization=quantization)
+            return
+        self.db = self.initialize_db(self.path(path.join('fasttext', '{}.db'.format(lang))))
 
-        if len(self) < self.sizes[self.lang]:
+        if not self.is_complete(size=self.sizes[self.lang]):
             self.clear()
             self.load_word2emb(show_progress=show_progress)
+            self.mark_complete(url=self.url.format(self.lang))
 
-    def emb(self, word, default=None):
-        if default is None:
-            default = self.default
-        get_default = {
-            'none': lambda: None,
-            'zero': lambda: 0.,
-            'random': lambda: random.uniform(-0.1, 0.1),
-        }[default]
-        g = self.lookup(word)
-        return [get_default() for i in range(self.d_emb)] if g is None else g
-
-    def load_word2emb(self, show_progress=True, batch_size=1000):
+    def load_word2emb(self, show_progress=True, batch_size=1000, workers=None):
+        # archive and progress bar modules are only needed to build the database
+        import zipfile
+        from tqdm import tqdm
         fin_name = self.ensure_file(path.join('fasttext', '{}.zip'.format(self.lang)), url=self.url.format(self.lang))
-        seen = set()
 
         with zipfile.ZipFile(fin_name) as fin:
-            content = fin.read('wiki.{}.vec'.format(self.lang))
-            lines = content.splitlines()
-            if show_progress:
-                lines = tqdm(lines)
-            batch = []
-            for line in lines:
-                elems = line.decode().rstrip().split()
-                vec = [float(n) for n in elems[-self.d_emb:]]
-                word = ' '.join(elems[:-self.d_emb])
-                if word in seen:
-                    continue
-                seen.add(word)
-                batch.append((word, vec))
-                if len(batch) == batch_size:
-                    self.insert_batch(batch)
-                    batch.clear()
-            if batch:
-                self.insert_batch(batch)
+            with fin.open('wiki.{}.vec'.format(self.lang), 'r') as fin_zipped:
+                if show_progress:
+                    fin_zipped = tqdm(fin_zipped)
+                self.ingest(fin_zipped, batch_size=batch_size, workers=workers)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,6 @@
-import random
 from collections import namedtuple
 from os import path
 
-import zipfile
-from tqdm import tqdm
 from embeddings.embedding import Embedding
 
 
@@ -24,62 +21,56 @@ class GloveEmbedding(Embedding):
                                            [50, 100, 200, 300], 400000, '6B token wikipedia 2014 + gigaword 5'),
     }
 
-    def __init__(self, name='common_crawl_840', d_emb=300, show_progress=True, default='none'):
+    def __init__(self, name='common_crawl_840', d_emb=300, show_progress=True, default='none', backend='sqlite', quantization='float32', as_numpy=False, subset=None):
         """
 
         Args:
             name: name of the embedding to retrieve.
             d_emb: embedding dimensions.
             show_progress: whether to print progress.
-            default: how to embed words that are out of vocabulary. Can use zeros, return ``None``, or generate random between ``[-0.1, 0.1]``.
+            default: how to embed words that are out of vocabulary. Can use zeros, return ``None``, generate random between ``[-0.1, 0.1]``, or ``hash`` the word into a vector in that range that is the same on every call.
+            backend: how to store the embeddings. Can use a ``sqlite`` database or a memory-mapped ``mmap`` matrix.
+            quantization: how to encode the embeddings in a ``mmap`` matrix. Can use ``float32``, ``float16``, ``int8`` or product quantization with ``pq``.
+            as_numpy: whether ``lookup`` and ``emb`` return float32 ``numpy.ndarray`` instead of lists.
+            subset: name of a subset built with ``subset`` to open instead of the full embeddings, with the ``backend`` and ``quantization`` it was built with.
         """
         assert name in self.settings, '{} is not a valid corpus. Valid options: {}'.format(name, self.settings)
         self.setting = self.settings[name]
         assert d_emb in self.setting.d_embs, '{} is not a valid dimension for {}. Valid options: {}'.format(d_emb, name, self.setting)
-        assert default in {'none', 'random', 'zero'}
+        assert default in {'none', 'random', 'zero', 'hash'}
+        assert backend in {'sqlite', 'mmap'}
+        assert quantization == 'float32' or backend == 'mmap', 'quantization requires the mmap backend'
 
         self.d_emb = d_emb
         self.name = name
-        self.db = self.initialize_db(self.path(path.join('glove', '{}:{}.db'.format(name, d_emb))))
         self.default = default
+        self.as_numpy = as_numpy
+        self.store_root = self.path(path.join('glove', '{}:{}'.format(name, d_emb)))
+
+        if subset is not None:
+            self.open_subset(subset, backend=backend, quantization=quantization)
+            return
+        if backend == 'mmap':
+            self.load_matrix(self.path(path.join('glove', '{}:{}.mmap'.format(name, d_emb))), show_progress=show_progress, quantization=quantization)
+            return
+        self.db = self.initialize_db(self.path(path.join('glove', '{}:{}.db'.format(name, d_emb))))
 
-        if len(self) < self.setting.size:
+        if not self.is_complete(size=self.setting.size):
             self.clear()
             self.load_word2emb(show_progress=show_progress)
+            self.mark_complete(url=self.setting.url)
 
-    def emb(self, word, default=None):
-        if default is None:
-            default = self.default
-        get_default = {
-            'none': lambda: None,
-            'zero': lambda: 0.,
-            'random': lambda: random.uniform(-0.1, 0.1),
-        }[default]
-        g = self.lookup(word)
-        return [get_default() for i in range(self.d_emb)] if g is None else g
-
-    def load_word2emb(self, show_progress=True, batch_size=1000):
+    def load_word2emb(self, show_progress=True, batch_size=1000, workers=None):
+        # archive and progress bar modules are only needed to build the database
+        import zipfile
+        from tqdm import tqdm
         fin_name = self.ensure_file(path.join('glove', '{}.zip'.format(self.name)), url=self.setting.url)
-        seen = set()
         with zipfile.ZipFile(fin_name) as fin:
             fname_zipped = [fzipped.filename for fzipped in fin.filelist if str(self.d_emb) in fzipped.filename][0]
             with fin.open(fname_zipped, 'r') as fin_zipped:
-                batch = []
                 if show_progress:
                     fin_zipped = tqdm(fin_zipped, total=self.setting.size)
-                for line in fin_zipped:
-                    elems = line.decode().rstrip().split()
-                    vec = [float(n) for n in elems[-self.d_emb:]]
-                    word = ' '.join(elems[:-self.d_emb])
-                    if word in seen:
-                        continue
-                    seen.add(word)
-                    batch.append((word, vec))
-                    if len(batch) == batch_size:
-                        self.insert_batch(batch)
-                        batch.clear()
-                if batch:
-                    self.insert_batch(batch)
+                self.ingest(fin_zipped, batch_size=batch_size, workers=workers)
 
 
 if __name__ == '__main__':
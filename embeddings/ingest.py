@@ -0,0 +1,85 @@
+from array import array
+from collections import deque
+from os import environ, cpu_count
+
+
+def default_workers():
+    """
+    Returns:
+        int: number of processes used to parse embedding files, taken from ``$EMBEDDINGS_WORKERS`` and defaulting to the number of cores.
+    """
+    return int(environ.get('EMBEDDINGS_WORKERS') or cpu_count() or 1)
+
+
+def parse_line(line, d_emb):
+    """
+    Parses a line of the form ``word x_1 ... x_d``, where the word itself may contain spaces.
+
+    Returns:
+        tuple: the word and its float32 embedding as bytes.
+    """
+    elems = line.decode().rstrip().split()
+    return ' '.join(elems[:-d_emb]), array('f', map(float, elems[-d_emb:])).tobytes()
+
+
+def parse_token_line(line, d_emb):
+    """
+    Parses a line of the form ``token x_1 ... x_d`` whose elements are separated by single spaces.
+
+    Returns:
+        tuple: the token and its float32 embedding as bytes.
+    """
+    elems = line.decode('utf-8').split(' ')
+    return elems[0], array('f', map(float, elems[1:])).tobytes()
+
+
+def parse_chunk(parse, lines, d_emb):
+    # lines whose dimensions differ from ``d_emb``, such as the header lines of word2vec style text files, are skipped
+    parsed = (parse(line, d_emb) for line in lines)
+    return [(w, e) for w, e in parsed if len(e) == 4 * d_emb]
+
+
+def chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_lines(lines, parse, d_emb, batch_size=1000, workers=None):
+    """
+    Parses lines of an embedding file in parallel.
+
+    Chunks of ``batch_size`` lines are parsed by a pool of ``workers`` processes while the caller consumes the results.
+    At most two chunks per worker are in flight, so memory stays bounded regardless of the size of the file.
+
+    Args:
+        lines (iterable): lines of the embedding file, as bytes.
+        parse (function): a module level function with the signature ``f(line, d_emb)`` that returns ``(word, bytes)``.
+        d_emb (int): embedding dimensions.
+        batch_size (int): number of lines per chunk.
+        workers (int): number of processes to parse with. Defaults to :func:`default_workers`. ``1`` parses in this process.
+
+    Returns:
+        generator: batches of ``(word, bytes)`` tuples, in the order of ``lines``. Lines whose dimensions differ from ``d_emb`` are skipped.
+
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1:
+        for chunk in chunks(lines, batch_size):
+            yield parse_chunk(parse, chunk, d_emb)
+        return
+    from multiprocessing import Pool
+    with Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks(lines, batch_size):
+            pending.append(pool.apply_async(parse_chunk, (parse, chunk, d_emb)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
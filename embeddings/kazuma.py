@@ -1,6 +1,6 @@
-import tarfile
+import threading
 import numpy as np
-from tqdm import tqdm
+from time import perf_counter
 from embeddings.embedding import Embedding
 
 
@@ -20,62 +20,217 @@ class KazumaCharEmbedding(Embedding):
     url = 'https://www.logos.t.u-tokyo.ac.jp/~hassy/publications/arxiv2016jmt/jmt_pre-trained_embeddings.tar.gz'
     size = 874474
     d_emb = 100
+    default = 'zero'
+    materialize = False
+    materialized_hits = materialized_misses = 0
 
-    def __init__(self, show_progress=True):
+    def __init__(self, show_progress=True, materialize=False, as_numpy=False, subset=None):
         """
 
         Args:
             show_progress: whether to print progress.
+            materialize: whether to save the embeddings computed for words in the database, so that later calls for the same words,
+                including in other processes, are a single lookup.
+            as_numpy: whether ``emb`` returns a float32 ``numpy.ndarray`` instead of a list.
+            subset: name of a subset built with ``subset`` to open instead of the full ngram table.
 
         """
 
-        self.db = self.initialize_db(self.path('kazuma.db'))
+        self.as_numpy = as_numpy
+        self.store_root = self.path('kazuma')
+        if subset is None:
+            self.db = self.initialize_db(self.path('kazuma.db'))
+        else:
+            self.open_subset(subset)
+        self.materialize = materialize
+        # the materialized table and its counters are written by every thread that embeds new words through the shared connection
+        self.materialize_lock = threading.Lock()
+        assert not (materialize and self.read_only()), 'materialize requires a writable database'
+        # computed word embeddings share the schema of the ngram table. Words without any ngram are stored with an empty blob.
+        if not self.read_only():
+            self.db.cursor().execute('create table if not exists word_embeddings(word text primary key, emb blob)')
 
-        if len(self) < self.size:
+        if subset is None and not self.is_complete(size=self.size):
             self.clear()
+            self.db.cursor().execute('delete from word_embeddings')
             self.load_word2emb(show_progress=show_progress)
+            self.mark_complete(url=self.url)
 
-    def emb(self, w, default='zero'):
+    def emb(self, w, default=None, as_numpy=None):
+        if default is None:
+            default = self.default
         assert default == 'zero', 'only zero default is supported for character embeddings'
+        if as_numpy is None:
+            as_numpy = self.as_numpy
+        embs, oov = self.emb_batch([w])
+        return embs[0] if as_numpy else embs[0].tolist()
+
+    def subset(self, name, words=None, corpus=None, backend='sqlite', quantization='float32', batch_size=10000):
+        """
+        The subset of a vocabulary holds the ngrams of its words, so words outside of the vocabulary are still embedded from the ngrams they share.
+        Ngrams are only read from SQLite, so subsets must use the ``sqlite`` backend.
+        """
+        assert backend == 'sqlite', 'character embeddings only support sqlite subsets'
+        return super().subset(name, words=words, corpus=corpus, backend=backend, quantization=quantization, batch_size=batch_size)
+
+    def subset_keys(self, words):
+        return super().subset_keys(g for w in words for g in self.grams(w))
+
+    def materialized_stats(self):
+        """
+
+        Returns:
+            dict: the number of words served from and missing from the materialized table by this object, and the number of words in the table.
+
+        """
+        size = self.db.cursor().execute('select count(*) from word_embeddings').fetchone()[0]
+        return dict(hits=self.materialized_hits, misses=self.materialized_misses, size=size)
+
+    def precompute(self, words, batch_size=10000):
+        """
+        Computes and saves the embeddings of ``words`` in the materialized table, skipping words that are already saved.
+
+        Args:
+            words (iterable): words to precompute.
+            batch_size (int): number of words to compute at a time.
+
+        """
+        batch = []
+        for w in words:
+            batch.append(w)
+            if len(batch) == batch_size:
+                self._materialize_batch(batch)
+                batch = []
+        if batch:
+            self._materialize_batch(batch)
+
+    def precompute_file(self, fname, batch_size=10000):
+        """
+        Precomputes the embeddings of every whitespace separated token in the text file ``fname``.
+
+        Args:
+            fname (str): corpus or vocabulary file, with one or more tokens per line.
+            batch_size (int): number of tokens to compute at a time.
+
+        """
+        with open(fname, encoding='utf-8') as f:
+            self.precompute((w for line in f for w in line.split()), batch_size=batch_size)
+
+    def _materialize_batch(self, words):
+        """
+
+        Returns:
+            dict: the materialized blob of each of the unique ``words``, computing and saving those that are missing.
+
+        """
+        unique = list(dict.fromkeys(words))
+        found = self._fetch_batch(unique, table='word_embeddings')
+        missing = [w for w in unique if w not in found]
+        if missing:
+            embs, oov = self.compute_batch(missing)
+            computed = [(w, b'' if o else e.tobytes()) for w, e, o in zip(missing, embs, oov)]
+        with self.materialize_lock:
+            self.materialized_hits += len(unique) - len(missing)
+            self.materialized_misses += len(missing)
+            if missing:
+                c = self.db.cursor()
+                c.execute('begin transaction')
+                c.executemany('insert or ignore into word_embeddings values (?, ?)', computed)
+                c.execute('commit')
+        if missing:
+            found.update(computed)
+        return found
+
+    @staticmethod
+    def grams(w):
+        """
+        Returns:
+            list: the unique character ngram keys of ``w``, in the form stored in the database.
+        """
         chars = ['#BEGIN#'] + list(w) + ['#END#']
-        embs = np.zeros(self.d_emb, dtype=np.float32)
-        match = {}
-        for i in [2, 3, 4]:
-            grams = ngrams(chars, i)
-            for g in grams:
-                g = '{}gram-{}'.format(i, ''.join(g))
-                e = self.lookup(g)
-                if e is not None:
-                    match[g] = np.array(e, np.float32)
-        if match:
-            embs = sum(match.values()) / len(match)
-        return embs.tolist()
-
-    def load_word2emb(self, show_progress=True, batch_size=1000):
+        keys = ['{}gram-{}'.format(i, ''.join(g)) for i in [2, 3, 4] for g in ngrams(chars, i)]
+        return list(dict.fromkeys(keys))
+
+    def emb_batch(self, words, default=None, out=None):
+        """
+        Embeds each word as the average embedding of its character ngrams that exist.
+
+        The ngrams of every word are resolved together with set-based queries, and the averages are computed with one vectorized reduction.
+        If ``materialize`` is set, words already computed are read from the materialized table instead, and new words are added to it.
+
+        Args:
+            words (list): words to embed.
+            default (str): how to embed words for which no ngram exists. Only ``zero`` is supported, which is also used for ``None``.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into.
+
+        Returns:
+            tuple: a float32 ``numpy.ndarray`` of shape ``(len(words), d_emb)`` and a boolean mask that is ``True`` for words without any ngram.
+
+        """
+        if default is None:
+            default = self.default
+        assert default == 'zero', 'only zero default is supported for character embeddings'
+        words = list(words)
+        if self.metrics is None:
+            return self._emb_batch(words, out)
+        start = perf_counter()
+        embs, oov = self._emb_batch(words, out)
+        self.record_batch('emb_batch', start, len(words), int(oov.sum()), oov_event='oov_default')
+        return embs, oov
+
+    def _emb_batch(self, words, out):
+        if not self.materialize:
+            return self.compute_batch(words, out=out)
+        found = self._materialize_batch(words)
+        embs = np.zeros((len(words), self.d_emb), dtype=np.float32) if out is None else out
+        oov = np.array([not found[w] for w in words], dtype=bool)
+        embs[oov] = 0
+        if not oov.all():
+            embs[~oov] = np.frombuffer(b''.join(found[w] for w in words), dtype=np.float32).reshape(-1, self.d_emb)
+        return embs, oov
+
+    def compute_batch(self, words, out=None):
+        """
+
+        Args:
+            words (list): words to embed.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into.
+
+        Returns:
+            tuple: the average ngram embeddings of ``words``, computed from the ngram table, and the boolean mask of words without any ngram.
+
+        """
+        if self.metrics is not None:
+            start = perf_counter()
+        grams = [self.grams(w) for w in words]
+        found = self._fetch_batch([g for gs in grams for g in gs])
+        # rows of the matched ngrams, grouped by word
+        vocab = {g: i for i, g in enumerate(found)}
+        matched = [[vocab[g] for g in gs if g in vocab] for gs in grams]
+        counts = np.array([len(m) for m in matched], dtype=np.int64)
+        embs = np.zeros((len(words), self.d_emb), dtype=np.float32) if out is None else out
+        oov = counts == 0
+        embs[oov] = 0
+        if found:
+            table = np.frombuffer(b''.join(found.values()), dtype=np.float32).reshape(len(found), self.d_emb)
+            flat = np.fromiter((i for m in matched for i in m), dtype=np.int64, count=int(counts.sum()))
+            starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[~oov]
+            embs[~oov] = np.add.reduceat(table[flat], starts, axis=0) / counts[~oov, None]
+        if self.metrics is not None:
+            self.record_batch('ngram_batch', start, len(words), int(oov.sum()))
+            self.metrics.incr(self.metrics_name + '.ngrams', sum(len(gs) for gs in grams))
+        return embs, oov
+
+    def load_word2emb(self, show_progress=True, batch_size=1000, workers=None):
+        # archive and progress bar modules are only needed to build the database
+        import tarfile
+        from tqdm import tqdm
         fin_name = self.ensure_file('kazuma.tar.gz', url=self.url)
-        seen = set()
 
         with tarfile.open(fin_name, 'r:gz') as fzip:
-            ftxt = fzip.extractfile('charNgram.txt')
-            content = ftxt.read()
-            ftxt.close()
-            lines = content.splitlines()
-            if show_progress:
-                lines = tqdm(lines)
-            batch = []
-            for line in lines:
-                elems = line.decode().rstrip().split()
-                vec = [float(n) for n in elems[-self.d_emb:]]
-                word = ' '.join(elems[:-self.d_emb])
-                if word in seen:
-                    continue
-                seen.add(word)
-                batch.append((word, vec))
-                if len(batch) == batch_size:
-                    self.insert_batch(batch)
-                    batch.clear()
-            if batch:
-                self.insert_batch(batch)
+            with fzip.extractfile('charNgram.txt') as ftxt:
+                lines = tqdm(ftxt, total=self.size) if show_progress else ftxt
+                self.ingest(lines, batch_size=batch_size, workers=workers)
 
 
 if __name__ == '__main__':
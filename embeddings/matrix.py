@@ -0,0 +1,336 @@
+import json
+import mmap
+import zlib
+from array import array
+from os import path, makedirs, remove
+
+import numpy as np
+
+from embeddings.quantize import codecs
+
+
+def word_hash(b):
+    """
+    Returns:
+        int: a hash of the utf-8 encoded word ``b`` that is stable across processes.
+    """
+    return zlib.crc32(b)
+
+
+class MatrixStore:
+    """
+    Read-only embeddings laid out as one contiguous matrix that is memory-mapped from disk.
+
+    The store is a directory with the following files:
+
+    - ``vectors.f32``: the ``(n, d_emb)`` float32 matrix, one row per word.
+      Quantized stores instead hold ``codes.bin``, a matrix of codes, and the parameters of their :class:`~embeddings.quantize.Codec`.
+    - ``words.bin``: the utf-8 encoded words, concatenated.
+    - ``offsets.npy``: int64 offsets of each word into ``words.bin``.
+    - ``index.npy``: an open addressing hash table from word to ``row + 1``, where ``0`` denotes an empty slot.
+    - ``meta.json``: the shape and quantization of the store, written last to mark the store as complete.
+
+    Every file is memory-mapped, so the operating system shares its pages between all processes that open the store.
+    """
+
+    def __init__(self, dname):
+        """
+
+        Args:
+            dname (str): directory of the store.
+        """
+        self.dname = dname
+        with open(path.join(dname, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.d_emb = self.meta['d_emb']
+        self.size = self.meta['size']
+        self.quantization = self.meta.get('quantization', 'float32')
+        self.codec = codecs[self.quantization](self.d_emb).load(dname)
+        fcodes = path.join(dname, 'vectors.f32' if self.quantization == 'float32' else 'codes.bin')
+        shape = (self.meta['rows'], self.codec.code_size)
+        self.codes = np.memmap(fcodes, dtype=self.codec.dtype, mode='r', shape=shape) if self.meta['rows'] else np.zeros(shape, dtype=self.codec.dtype)
+        # float32 stores expose their rows directly, without decoding.
+        self.vectors = self.codes if self.quantization == 'float32' else None
+        self.offsets = np.load(path.join(dname, 'offsets.npy'), mmap_mode='r')
+        self.index = np.load(path.join(dname, 'index.npy'), mmap_mode='r')
+        self.mask = len(self.index) - 1
+        self._fwords = open(path.join(dname, 'words.bin'), 'rb')
+        self.words = mmap.mmap(self._fwords.fileno(), 0, access=mmap.ACCESS_READ) if path.getsize(path.join(dname, 'words.bin')) else b''
+
+    @staticmethod
+    def exists(dname):
+        """
+        Returns:
+            bool: whether a complete store exists at ``dname``.
+        """
+        return path.isfile(path.join(dname, 'meta.json'))
+
+    def __len__(self):
+        return self.size
+
+    def load_memory(self):
+        """
+        Reads the store into memory, so that lookups no longer touch the disk.
+        """
+        self.codes = np.array(self.codes)
+        if self.vectors is not None:
+            self.vectors = self.codes
+        self.offsets = np.array(self.offsets)
+        self.index = np.array(self.index)
+        words = bytes(self.words)
+        self.close()
+        self.words = words
+
+    def close(self):
+        if isinstance(self.words, mmap.mmap):
+            self.words.close()
+        self._fwords.close()
+
+    def row(self, w):
+        """
+
+        Args:
+            w (str): word to look up.
+
+        Returns:
+            int: the row of ``w`` in the matrix, or ``-1`` if it does not exist.
+
+        """
+        b = w.encode('utf-8')
+        h = word_hash(b) & self.mask
+        while True:
+            r = int(self.index[h])
+            if r == 0:
+                return -1
+            r -= 1
+            if self.words[self.offsets[r]:self.offsets[r+1]] == b:
+                return r
+            h = (h + 1) & self.mask
+
+    def word(self, r):
+        """
+
+        Args:
+            r (int): row in the matrix.
+
+        Returns:
+            str: the word stored at row ``r``.
+
+        """
+        return self.words[self.offsets[r]:self.offsets[r+1]].decode('utf-8')
+
+    def valid_rows(self):
+        """
+
+        Returns:
+            numpy.ndarray: the sorted rows that are reachable from the index, which excludes later occurrences of duplicate words.
+
+        """
+        return np.sort(self.index[self.index > 0] - 1)
+
+    def rows(self, words):
+        """
+
+        Args:
+            words (list): words to look up.
+
+        Returns:
+            numpy.ndarray: int64 rows of ``words`` in the matrix, ``-1`` for words that do not exist.
+
+        """
+        return np.fromiter((self.row(w) for w in words), dtype=np.int64, count=len(words))
+
+    def lookup(self, w):
+        """
+
+        Args:
+            w (str): word to look up.
+
+        Returns:
+            numpy.ndarray: the float32 row for ``w``, if it exists, which is a read-only view unless the store is quantized.
+            ``None``, otherwise.
+
+        """
+        r = self.row(w)
+        if r < 0:
+            return None
+        return self.vectors[r] if self.vectors is not None else self.codec.decode(self.codes[r:r+1])[0]
+
+    def get(self, rows):
+        """
+
+        Args:
+            rows (numpy.ndarray): rows to read.
+
+        Returns:
+            numpy.ndarray: ``(len(rows), d_emb)`` float32 matrix of the decoded rows.
+
+        """
+        return self.codec.decode(self.codes[rows])
+
+    def lookup_batch(self, words, out=None):
+        """
+
+        Args:
+            words (list): words to look up.
+            out (numpy.ndarray): optional float32 array of shape ``(len(words), d_emb)`` to write the embeddings into.
+
+        Returns:
+            tuple: a float32 matrix of embeddings, zero for words that do not exist, and the boolean out of vocabulary mask.
+
+        """
+        rows = self.rows(words)
+        oov = rows < 0
+        if out is None:
+            embs = np.zeros((len(words), self.d_emb), dtype=np.float32)
+        else:
+            embs = out
+            embs[oov] = 0
+        embs[~oov] = self.get(rows[~oov])
+        return embs, oov
+
+
+class MatrixWriter:
+    """
+    Builds a :class:`MatrixStore` by appending batches of embeddings.
+
+    The hash index is built when the writer is closed. If a word is appended more than once, the first occurrence wins.
+    Rows whose dimensions differ from ``d_emb``, such as the header lines of word2vec style text files, are skipped.
+    Quantized stores are written as float32 first, then a codec is fit on a sample of rows and the matrix is encoded in blocks.
+    The reconstruction error of the codec on the sample is recorded in ``meta.json``.
+
+    Example:
+
+    .. code-block:: python
+
+        with MatrixWriter('mystore', d_emb=3) as w:
+            w.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+        store = MatrixStore('mystore')
+    """
+
+    def __init__(self, dname, d_emb, meta=None, quantization='float32', sample_size=65536):
+        """
+
+        Args:
+            dname (str): directory of the store.
+            d_emb (int): embedding dimensions.
+            meta (dict): additional information to record in ``meta.json``.
+            quantization (str): how to store the embeddings. One of ``float32``, ``float16``, ``int8`` or ``pq``.
+            sample_size (int): number of rows to fit the codec on.
+        """
+        assert quantization in codecs, '{} is not a valid quantization. Valid options: {}'.format(quantization, list(codecs))
+        if not path.isdir(dname):
+            makedirs(dname)
+        if MatrixStore.exists(dname):
+            remove(path.join(dname, 'meta.json'))
+        self.dname = dname
+        self.d_emb = d_emb
+        self.meta = meta or {}
+        self.quantization = quantization
+        self.sample_size = sample_size
+        self.offsets = array('q', [0])
+        self.fvectors = open(path.join(dname, 'vectors.f32'), 'wb')
+        self.fwords = open(path.join(dname, 'words.bin'), 'wb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.fvectors.close()
+            self.fwords.close()
+
+    def insert_batch(self, batch):
+        """
+
+        Args:
+            batch (list): a list of embeddings to insert, each of which is a tuple ``(word, embeddings)``.
+        """
+        self.insert_binary_batch([(word, array('f', emb).tobytes()) for word, emb in batch])
+
+    def insert_binary_batch(self, batch):
+        """
+
+        Args:
+            batch (list): a list of embeddings to insert, each of which is a tuple ``(word, bytes)`` where ``bytes`` holds the float32 embeddings.
+        """
+        for word, emb in batch:
+            if len(emb) != 4 * self.d_emb:
+                continue
+            b = word.encode('utf-8')
+            self.fvectors.write(emb)
+            self.fwords.write(b)
+            self.offsets.append(self.offsets[-1] + len(b))
+
+    def insert_matrix(self, words, embs):
+        """
+
+        Args:
+            words (list): words to insert.
+            embs (numpy.ndarray): ``(len(words), d_emb)`` float32 matrix of their embeddings.
+        """
+        assert embs.shape == (len(words), self.d_emb), 'expected a matrix of shape {}'.format((len(words), self.d_emb))
+        self.fvectors.write(np.ascontiguousarray(embs, dtype=np.float32).tobytes())
+        for word in words:
+            b = word.encode('utf-8')
+            self.fwords.write(b)
+            self.offsets.append(self.offsets[-1] + len(b))
+
+    def close(self):
+        """
+        Builds the hash index and marks the store as complete.
+        """
+        self.fvectors.close()
+        self.fwords.close()
+        rows = len(self.offsets) - 1
+        n_slots = 1
+        while n_slots < 2 * rows:
+            n_slots *= 2
+        mask = n_slots - 1
+        index = np.zeros(n_slots, dtype=np.int64)
+        size = 0
+        with open(path.join(self.dname, 'words.bin'), 'rb') as f:
+            words = f.read()
+        offsets = self.offsets
+        for r in range(rows):
+            b = words[offsets[r]:offsets[r+1]]
+            h = word_hash(b) & mask
+            while index[h]:
+                existing = index[h] - 1
+                if words[offsets[existing]:offsets[existing+1]] == b:
+                    break
+                h = (h + 1) & mask
+            else:
+                index[h] = r + 1
+                size += 1
+        np.save(path.join(self.dname, 'offsets.npy'), np.frombuffer(offsets, dtype=np.int64))
+        np.save(path.join(self.dname, 'index.npy'), index)
+        meta = dict(self.meta, d_emb=self.d_emb, rows=rows, size=size, quantization=self.quantization)
+        if self.quantization != 'float32':
+            meta['reconstruction'] = self.quantize(rows, index)
+        with open(path.join(self.dname, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def quantize(self, rows, index, block_size=65536):
+        """
+        Encodes ``vectors.f32`` into ``codes.bin`` and removes it.
+
+        Returns:
+            dict: the reconstruction error of the codec on the sample it was fit on.
+        """
+        fvectors = path.join(self.dname, 'vectors.f32')
+        codec = codecs[self.quantization](self.d_emb)
+        with open(path.join(self.dname, 'codes.bin'), 'wb') as fcodes:
+            if rows:
+                vectors = np.memmap(fvectors, dtype=np.float32, mode='r', shape=(rows, self.d_emb))
+                valid = np.sort(index[index > 0] - 1)
+                sample = np.asarray(vectors[np.sort(np.random.RandomState(0).choice(valid, min(len(valid), self.sample_size), replace=False))])
+                codec.fit(sample)
+                for start in range(0, rows, block_size):
+                    fcodes.write(codec.encode(np.asarray(vectors[start:start+block_size])).tobytes())
+                del vectors
+        codec.save(self.dname)
+        remove(fvectors)
+        return codec.reconstruction_error(sample) if rows else {}
@@ -0,0 +1,143 @@
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from time import perf_counter
+
+
+class Histogram:
+    """
+    A latency histogram with exponential buckets, from 1 microsecond to about 16 seconds, each twice as wide as the previous one.
+    Percentiles are estimated as the upper bound of the bucket they fall in, so they are at most twice the actual value.
+    """
+
+    bounds = [1e-6 * 2 ** i for i in range(25)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        """
+
+        Args:
+            q (float): percentile between 0 and 100.
+
+        Returns:
+            float: an upper bound of the ``q``-th percentile, in seconds. ``0`` if nothing was observed.
+
+        """
+        if not self.count:
+            return 0.
+        rank, seen = q / 100 * self.count, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """
+
+        Returns:
+            dict: the number of observations, their mean, maximum and estimated p50, p95 and p99 in seconds, and the count per bucket upper bound.
+
+        """
+        return dict(
+            count=self.count, mean=self.total / self.count if self.count else 0., max=self.max,
+            p50=self.percentile(50), p95=self.percentile(95), p99=self.percentile(99),
+            buckets={b: c for b, c in zip(self.bounds + [float('inf')], self.counts) if c},
+        )
+
+
+class Metrics:
+    """
+    Thread-safe counters and latency histograms, keyed by name.
+
+    Embeddings record into a ``Metrics`` object once ``enable_metrics`` is called, under names of the form ``<embedding>.<event>``.
+    One object can be shared by several embeddings, for instance those of a ``ConcatEmbedding``.
+
+    Example:
+
+    .. code-block:: python
+
+        m = g.enable_metrics()
+        g.emb('canada')
+        m.snapshot()['counters']  # {'GloveEmbedding.lookup': 1, ...}
+        m.add_hook(lambda kind, name, value: statsd.send(kind, name, value))
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.hooks = []
+
+    def incr(self, name, n=1):
+        """
+        Adds ``n`` to the counter ``name``.
+        """
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+        for hook in self.hooks:
+            hook('count', name, n)
+
+    def observe(self, name, seconds):
+        """
+        Records a latency of ``seconds`` in the histogram ``name``, and counts it in the counter of the same name.
+        """
+        with self.lock:
+            h = self.histograms.get(name)
+            if h is None:
+                h = self.histograms[name] = Histogram()
+            h.observe(seconds)
+            self.counters[name] = self.counters.get(name, 0) + 1
+        for hook in self.hooks:
+            hook('latency', name, seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """
+        Records the time spent in the ``with`` block in the histogram ``name``.
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start)
+
+    def add_hook(self, hook):
+        """
+
+        Args:
+            hook (function): called as ``hook(kind, name, value)`` for every record, where ``kind`` is ``count`` or ``latency``.
+                Hooks run in the thread that records, so they should be fast, such as putting the record on a queue.
+
+        """
+        self.hooks.append(hook)
+
+    def snapshot(self):
+        """
+
+        Returns:
+            dict: ``counters``, the value of every counter, and ``histograms``, the ``Histogram.snapshot`` of every histogram.
+
+        """
+        with self.lock:
+            return dict(counters=dict(self.counters), histograms={k: h.snapshot() for k, h in self.histograms.items()})
+
+    def reset(self):
+        """
+        Clears every counter and histogram. Hooks are kept.
+        """
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
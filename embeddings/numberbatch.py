@@ -1,11 +1,8 @@
-import gzip
-import random
-
 from collections import namedtuple
 from os import path
-from tqdm import tqdm
 
 from embeddings.embedding import Embedding
+from embeddings.ingest import parse_token_line
 
 
 class NumberbatchEmbedding(Embedding):
@@ -70,41 +67,68 @@ class NumberbatchEmbedding(Embedding):
             "17.02"
         )
     }
+    d_emb = 300
 
-    def __init__(self, name="1908-en", show_progress="True", default="none"):
+    def __init__(self, name="1908-en", show_progress="True", default="none", backend="sqlite", quantization="float32", as_numpy=False, subset=None):
         """
         Arguments:
         name -- Defines the embedding version/langauge combination to be used. Valid values are
                 1908-en, 1908-ml, 1706-en, 1706-ml, 1704-en, 1704-ml and 1702-en (en for English,
                 ml for multilingual).
         show_progress -- Whether to print a progress bar or not.
-        default -- How to embed words that are out-of-vocabulary. Valid values are "none", "zero"
-                   and "random".
+        default -- How to embed words that are out-of-vocabulary. Valid values are "none", "zero",
+                   "random" and "hash", which derives the same vector for a word on every call.
+        backend -- How to store the embeddings. Valid values are "sqlite" for a database and "mmap"
+                   for a memory-mapped matrix.
+        quantization -- How to encode the embeddings in a "mmap" matrix. Valid values are "float32",
+                        "float16", "int8" and "pq" for product quantization.
+        as_numpy -- Whether lookup and emb return float32 numpy arrays instead of lists.
+        subset -- Name of a subset built with subset to open instead of the full embeddings, with the
+                  backend and quantization it was built with.
         """
 
         # Test if provided parameters are valid
         assert name in self.nb_settings, f"{name} is not a valid name. Valid options are: {self.settings}."
-        assert default in {"none", "zero", "random"}
+        assert default in {"none", "zero", "random", "hash"}
+        assert backend in {"sqlite", "mmap"}
+        assert quantization == "float32" or backend == "mmap", "quantization requires the mmap backend"
 
         # Setting default class values
         self.embedding_dimension = 300
         self.name = name
         self.default = default
+        self.as_numpy = as_numpy
         self.setting = self.nb_settings[name]
+        self.store_root = self.path(path.join("numberbatch", name))
+
+        # A subset only holds the embeddings of a vocabulary, and is built from the full embeddings
+        if subset is not None:
+            self.open_subset(subset, backend=backend, quantization=quantization)
+            return
+
+        # The memory-mapped matrix store is only considered complete once it has been fully built
+        if backend == "mmap":
+            self.load_matrix(self.path(path.join("numberbatch", f"{name}.mmap")), show_progress=show_progress, quantization=quantization)
+            return
         self.db = self.initialize_db(self.path(path.join("numberbatch", f"{name}.db")))
 
         # Check if embedding database already exists/is complete, and create/fill it otherwise
-        if len(self) < self.setting.size:
+        if not self.is_complete(size=self.setting.size):
             self.clear()
             self.load_word2emb(show_progress=show_progress)
+            self.mark_complete(url=self.setting.url)
 
-    def load_word2emb(self, show_progress=True, batch_size=1000):
+    def load_word2emb(self, show_progress=True, batch_size=1000, workers=None):
         """Load the word embeddings from a gzipped file and write them to the database.
 
         Arguments:
         show_progress -- Whether to print a progress bar or not.
         batch_size -- The number of tokens to add to the database at a time.
+        workers -- The number of processes used to parse the file. Defaults to the number of cores.
         """
+        # Archive and progress bar modules are only needed to build the database
+        import gzip
+        from tqdm import tqdm
 
         # Download embedding file if it does not exist yet
         embedding_file_name = self.ensure_file(
@@ -116,50 +140,9 @@ class NumberbatchEmbedding(Embedding):
             # Enable the progress bar, if required
             file_content = tqdm(f, total=self.setting.size) if show_progress else f
 
-            # Temporary storage for all unique words
-            seen = set()
-            # Temporary storage for the currently processed batch
-            batch = []
-            for line in file_content:
-                # Elements in each line are separated by a space, where the first element will
-                # always be the string representation of the token and the remaining 300 the vector
-                # values.
-                line_decoded = line.decode("utf-8")
-                all_elements = line_decoded.split(" ")
-                token = all_elements[0]
-                vector = [float(n) for n in all_elements[1:]]
-
-                if token in seen:
-                    continue
-
-                seen.add(token)
-                batch.append((token, vector))
-
-                if len(batch) == batch_size:
-                    self.insert_batch(batch)
-                    batch.clear()
-
-            # Add any remaining tokens to the database
-            if batch:
-                self.insert_batch(batch)
-
-    def emb(self, word, default=None):
-        if default is None:
-            default = self.default
-
-        # Produce default vector for out-of-vocabulary tokens
-        get_default = {
-            "none": lambda: None,
-            "zero": lambda: 0.,
-            "random": lambda: random.uniform(-0.1, 0.1)
-        }[default]
-
-        # Get the actual word vector, if possible
-        vector = self.lookup(word)
-
-        return [
-            get_default() for i in range(self.embedding_dimension)
-        ] if vector is None else vector
+            # Elements in each line are separated by a space, where the first element will always be
+            # the string representation of the token and the remaining 300 the vector values.
+            self.ingest(file_content, parse=parse_token_line, batch_size=batch_size, workers=workers)
 
 
 if __name__ == '__main__':
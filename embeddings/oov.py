@@ -0,0 +1,25 @@
+import hashlib
+
+import numpy as np
+
+
+def hash_vector(word, d_emb, seed=0, scale=0.1):
+    """
+    Derives a pseudo-random embedding for ``word`` from a hash of the word.
+
+    The bytes of a SHAKE-128 digest of the seed and the word are read as unsigned integers and scaled to ``[-scale, scale)``,
+    so that the same word always gets the same vector, in every process and on every machine, regardless of random state.
+
+    Args:
+        word (str): word to embed.
+        d_emb (int): embedding dimensions.
+        seed (int): seed mixed into the hash. Different seeds give independent vectors.
+        scale (float): bound of the range of each dimension.
+
+    Returns:
+        numpy.ndarray: float32 embedding of shape ``(d_emb,)``.
+
+    """
+    digest = hashlib.shake_128('{}:{}'.format(seed, word).encode('utf-8')).digest(4 * d_emb)
+    ints = np.frombuffer(digest, dtype='<u4')
+    return (ints * (2 * scale / 2 ** 32) - scale).astype(np.float32)
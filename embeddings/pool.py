@@ -0,0 +1,82 @@
+import os
+import sqlite3
+import threading
+import weakref
+from urllib.parse import quote
+
+
+class ReaderConnection(sqlite3.Connection):
+    """
+    A connection of a ``ReaderPool``. Unlike ``sqlite3.Connection``, it can be weakly referenced, so that the pool can find it without keeping it open.
+    """
+
+
+class ReaderPool:
+    """
+    Read-only connections to one SQLite database, one per thread and per process.
+
+    Each thread gets its own connection the first time it calls ``get``, so threads never share a connection or wait on each other.
+    Only the thread holds its connection, which is closed when the thread exits.
+    A connection opened before a fork is never used by the child: the child opens its own on its first ``get``.
+
+    Example:
+
+    .. code-block:: python
+
+        pool = ReaderPool('glove.db', immutable=True)
+        pool.get().execute('select emb from embeddings where word = ?', ('hello',)).fetchone()
+    """
+
+    def __init__(self, fname, immutable=False, mmap_size=1 << 34):
+        """
+
+        Args:
+            fname (str): location of the database.
+            immutable (bool): whether to promise SQLite that the file never changes, which skips locking and change detection entirely.
+                Only set this for a database that is no longer written to, by any process.
+            mmap_size (int): number of bytes of the database to read through a memory map rather than with reads into a private page cache.
+                SQLite caps this at its compile-time maximum. ``0`` disables memory-mapped reads.
+        """
+        self.fname = os.path.abspath(fname)
+        self.immutable = immutable
+        self.mmap_size = mmap_size
+        self.uri = 'file:{}?mode=ro{}'.format(quote(self.fname), '&immutable=1' if immutable else '')
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        # connections opened by any thread, which ``close`` closes. Only weakly referenced, so that exited threads release theirs.
+        self.connections = weakref.WeakSet()
+
+    def connect(self):
+        """
+        Returns:
+            sqlite3.Connection: a new read-only connection.
+        """
+        db = sqlite3.connect(self.uri, uri=True, isolation_level=None, check_same_thread=False, factory=ReaderConnection)
+        db.execute('pragma mmap_size = {}'.format(int(self.mmap_size)))
+        db.pid = os.getpid()
+        with self.lock:
+            self.connections.add(db)
+        return db
+
+    def get(self):
+        """
+        Returns:
+            sqlite3.Connection: the connection of the calling thread, opened on first use.
+        """
+        pid = os.getpid()
+        if getattr(self.local, 'pid', None) != pid:
+            self.local.db = self.connect()
+            self.local.pid = pid
+        return self.local.db
+
+    def close(self):
+        """
+        Closes every connection opened by this process. Threads that use the pool afterwards open new connections.
+        """
+        pid = os.getpid()
+        with self.lock:
+            connections, self.connections = list(self.connections), weakref.WeakSet()
+        for db in connections:
+            if db.pid == pid:
+                db.close()
+        self.local = threading.local()
@@ -0,0 +1,225 @@
+from os import path
+
+import numpy as np
+
+from embeddings.ann import assign, kmeans
+
+
+class Codec:
+    """
+    Encodes float32 embeddings into compact codes and decodes them back.
+
+    Subclasses set ``name`` and ``dtype``, and implement ``encode`` and ``decode``.
+    Codecs with parameters implement ``fit``, ``save`` and ``load``.
+    """
+
+    name = None
+    dtype = None
+
+    def __init__(self, d_emb):
+        """
+
+        Args:
+            d_emb (int): embedding dimensions.
+        """
+        self.d_emb = d_emb
+
+    @property
+    def code_size(self):
+        """
+        Returns:
+            int: number of code elements per embedding.
+        """
+        return self.d_emb
+
+    def fit(self, sample):
+        """
+
+        Args:
+            sample (numpy.ndarray): float32 matrix of embeddings to estimate the parameters of the codec from.
+
+        Returns:
+            Codec: this codec.
+
+        """
+        return self
+
+    def encode(self, embs):
+        """
+
+        Args:
+            embs (numpy.ndarray): ``(n, d_emb)`` float32 matrix of embeddings.
+
+        Returns:
+            numpy.ndarray: ``(n, code_size)`` matrix of codes of type ``dtype``.
+
+        """
+        raise NotImplementedError()
+
+    def decode(self, codes):
+        """
+
+        Args:
+            codes (numpy.ndarray): ``(n, code_size)`` matrix of codes.
+
+        Returns:
+            numpy.ndarray: ``(n, d_emb)`` float32 matrix of reconstructed embeddings.
+
+        """
+        raise NotImplementedError()
+
+    def save(self, dname):
+        pass
+
+    def load(self, dname):
+        return self
+
+    def reconstruction_error(self, sample):
+        """
+
+        Args:
+            sample (numpy.ndarray): float32 matrix of embeddings.
+
+        Returns:
+            dict: the mean relative L2 error ``|x - x'| / |x|`` and the mean cosine similarity between each embedding and its reconstruction.
+
+        """
+        recon = self.decode(self.encode(sample))
+        norms = np.linalg.norm(sample, axis=1)
+        valid = norms > 0
+        if not valid.any():
+            return dict(relative_error=0., cosine=1.)
+        sample, recon, norms = sample[valid], recon[valid], norms[valid]
+        recon_norms = np.linalg.norm(recon, axis=1)
+        recon_norms[recon_norms == 0] = 1
+        return dict(
+            relative_error=float(np.mean(np.linalg.norm(sample - recon, axis=1) / norms)),
+            cosine=float(np.mean((sample * recon).sum(axis=1) / norms / recon_norms)),
+        )
+
+
+class Float32Codec(Codec):
+    """
+    Stores embeddings as they are.
+    """
+
+    name = 'float32'
+    dtype = np.float32
+
+    def encode(self, embs):
+        return np.asarray(embs, dtype=np.float32)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+
+class Float16Codec(Codec):
+    """
+    Stores embeddings as half precision floats, at half the size.
+    """
+
+    name = 'float16'
+    dtype = np.float16
+
+    def encode(self, embs):
+        return np.asarray(embs).astype(np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes).astype(np.float32)
+
+
+class Int8Codec(Codec):
+    """
+    Stores each dimension as one byte, scaled between the minimum and maximum of that dimension, at a quarter of the size.
+    Values outside of the range seen by ``fit`` are clipped.
+    """
+
+    name = 'int8'
+    dtype = np.uint8
+
+    def fit(self, sample):
+        self.offset = sample.min(axis=0).astype(np.float32)
+        self.scale = ((sample.max(axis=0) - self.offset) / 255).astype(np.float32)
+        self.scale[self.scale == 0] = 1
+        return self
+
+    def encode(self, embs):
+        return np.clip(np.rint((np.asarray(embs) - self.offset) / self.scale), 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return np.asarray(codes).astype(np.float32) * self.scale + self.offset
+
+    def save(self, dname):
+        np.save(path.join(dname, 'offset.npy'), self.offset)
+        np.save(path.join(dname, 'scale.npy'), self.scale)
+
+    def load(self, dname):
+        self.offset = np.load(path.join(dname, 'offset.npy'))
+        self.scale = np.load(path.join(dname, 'scale.npy'))
+        return self
+
+
+class PQCodec(Codec):
+    """
+    Product quantization: each embedding is split into ``n_subspaces`` blocks, and each block is replaced by the index of the
+    closest of 256 centroids learned with k-means for that block. Each embedding then takes ``n_subspaces`` bytes.
+    """
+
+    name = 'pq'
+    dtype = np.uint8
+
+    def __init__(self, d_emb, n_subspaces=None, n_iter=10, seed=0):
+        """
+
+        Args:
+            d_emb (int): embedding dimensions.
+            n_subspaces (int): number of blocks, which must divide ``d_emb``. Defaults to the largest divisor of ``d_emb`` that is at most ``d_emb / 4``.
+            n_iter (int): number of k-means iterations.
+            seed (int): random seed.
+        """
+        super().__init__(d_emb)
+        if n_subspaces is None:
+            n_subspaces = max(m for m in range(1, max(1, d_emb // 4) + 1) if d_emb % m == 0)
+        assert d_emb % n_subspaces == 0, '{} subspaces do not divide {} dimensions'.format(n_subspaces, d_emb)
+        self.n_subspaces = n_subspaces
+        self.d_sub = d_emb // n_subspaces
+        self.n_iter = n_iter
+        self.seed = seed
+
+    @property
+    def code_size(self):
+        return self.n_subspaces
+
+    def split(self, embs):
+        return np.asarray(embs, dtype=np.float32).reshape(len(embs), self.n_subspaces, self.d_sub)
+
+    def fit(self, sample):
+        n_centroids = min(256, len(sample))
+        blocks = self.split(sample)
+        self.codebooks = np.stack([
+            kmeans(np.ascontiguousarray(blocks[:, j]), n_centroids, n_iter=self.n_iter, seed=self.seed, spherical=False)
+            for j in range(self.n_subspaces)
+        ])
+        return self
+
+    def encode(self, embs):
+        blocks = self.split(embs)
+        codes = np.empty((len(embs), self.n_subspaces), dtype=np.uint8)
+        for j in range(self.n_subspaces):
+            codes[:, j] = assign(np.ascontiguousarray(blocks[:, j]), self.codebooks[j], spherical=False)
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        return self.codebooks[np.arange(self.n_subspaces), codes].reshape(len(codes), self.d_emb)
+
+    def save(self, dname):
+        np.save(path.join(dname, 'codebooks.npy'), self.codebooks)
+
+    def load(self, dname):
+        self.codebooks = np.load(path.join(dname, 'codebooks.npy'))
+        self.n_subspaces, _, self.d_sub = self.codebooks.shape
+        return self
+
+
+codecs = {c.name: c for c in [Float32Codec, Float16Codec, Int8Codec, PQCodec]}
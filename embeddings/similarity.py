@@ -0,0 +1,80 @@
+import numpy as np
+
+
+def normalize(embs):
+    """
+    Scales the rows of ``embs`` to unit L2 norm in place. Rows of zeros are left as zeros.
+
+    Args:
+        embs (numpy.ndarray): float32 matrix of embeddings.
+
+    Returns:
+        numpy.ndarray: ``embs``.
+
+    """
+    norms = np.linalg.norm(embs, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    embs /= norms
+    return embs
+
+
+def topk(scores, ids, k):
+    """
+
+    Args:
+        scores (numpy.ndarray): ``(n_queries, n)`` scores.
+        ids (numpy.ndarray): ``(n_queries, n)`` ids corresponding to ``scores``.
+        k (int): number of results to keep.
+
+    Returns:
+        tuple: the ``(n_queries, k)`` highest scores and their ids, sorted by decreasing score.
+
+    """
+    k = min(k, scores.shape[1])
+    if k < scores.shape[1]:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        scores = np.take_along_axis(scores, part, axis=1)
+        ids = np.take_along_axis(ids, part, axis=1)
+    order = np.argsort(-scores, axis=1, kind='stable')
+    return np.take_along_axis(scores, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def search(vectors, queries, k, exclude=None, block_size=65536):
+    """
+    Finds the rows of ``vectors`` with the highest dot product with each query.
+
+    ``vectors`` is processed in blocks of ``block_size`` rows, so that a memory-mapped matrix never needs to be in memory at once.
+    The top ``k`` of each block is merged into a running top ``k``.
+
+    Args:
+        vectors (numpy.ndarray): ``(n, d)`` matrix to search.
+        queries (numpy.ndarray): ``(n_queries, d)`` matrix of queries.
+        k (int): number of results per query.
+        exclude (numpy.ndarray): optional row to exclude for each query, ``-1`` to exclude nothing.
+        block_size (int): number of rows of ``vectors`` to score at a time.
+
+    Returns:
+        tuple: ``(n_queries, k)`` scores and rows, sorted by decreasing score.
+
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    n_queries = len(queries)
+    best_scores = np.zeros((n_queries, 0), dtype=np.float32)
+    best_ids = np.zeros((n_queries, 0), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start+block_size])
+        scores = queries @ block.T
+        if exclude is not None:
+            hit = (exclude >= start) & (exclude < start + len(block))
+            scores[hit, exclude[hit] - start] = -np.inf
+        ids = np.broadcast_to(np.arange(start, start + len(block), dtype=np.int64), scores.shape)
+        scores, ids = topk(scores, ids, k)
+        best_scores, best_ids = topk(np.concatenate([best_scores, scores], axis=1), np.concatenate([best_ids, ids], axis=1), k)
+    if exclude is not None:
+        # an excluded row only surfaces when there are fewer than k other rows
+        valid = best_ids != exclude[:, None]
+        if not valid.all():
+            k = int(valid.sum(axis=1).min())
+            best_scores = np.stack([s[v][:k] for s, v in zip(best_scores, valid)])
+            best_ids = np.stack([i[v][:k] for i, v in zip(best_ids, valid)])
+    return best_scores, best_ids
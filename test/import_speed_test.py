@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+import subprocess
+import sys
+import json
+import os
+
+
+# what the package imported before backends were loaded lazily, and what it imports now.
+statements = {
+    'eager': 'import embeddings.glove, embeddings.fasttext, embeddings.kazuma, embeddings.concat, embeddings.numberbatch, requests, tqdm',
+    'import embeddings': 'import embeddings',
+    'from embeddings import GloveEmbedding': 'from embeddings import GloveEmbedding',
+}
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy = ['numpy', 'requests', 'tqdm', 'tarfile', 'gzip', 'asyncio', 'multiprocessing']
+
+
+def measure(statement):
+    code = 'import sys, time, json; start = time.perf_counter(); {}; t = time.perf_counter() - start; print(json.dumps([t, [m for m in {} if m in sys.modules]]))'
+    out = subprocess.run([sys.executable, '-c', code.format(statement, heavy)], capture_output=True, text=True, check=True, env=dict(os.environ, PYTHONPATH=repo))
+    return json.loads(out.stdout)
+
+
+if __name__ == '__main__':
+    n_runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    results = {}
+    for name, statement in statements.items():
+        runs = [measure(statement) for _ in range(n_runs)]
+        times = sorted(t for t, _ in runs)
+        results[name] = dict(median_ms=times[len(times) // 2] * 1e3, modules=runs[0][1])
+    eager = results['eager']['median_ms']
+    print('{:<40}{:>12}{:>10}  {}'.format('statement', 'median (ms)', 'saved', 'heavy modules'))
+    for name, r in results.items():
+        print('{:<40}{:>12.1f}{:>9.0f}%  {}'.format(name, r['median_ms'], 100 * (1 - r['median_ms'] / eager), ', '.join(r['modules'])))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+Benchmarks every backend and storage mode on synthetic archives, without network access.
+
+Archives in the format of each loader are generated into a temporary ``$EMBEDDINGS_ROOT``. Each configuration is then built and queried in
+fresh processes, which measure:
+
+- ingest: rows per second and the memory high-water mark while building the store.
+- startup: time to import the backend and open the built store.
+- lookup: p50, p95 and p99 latency of single ``emb`` calls, 10% of which are out of vocabulary.
+- batch: words per second through ``emb_batch``.
+
+Results are printed and written as JSON, and can be compared with the JSON of a previous version:
+
+    python test/offline_speed_test.py --out new.json --baseline old.json
+"""
+import argparse
+import gzip
+import io
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+# the tree being benchmarked, rather than any installed copy of the package, in this process as in the child processes
+repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo)
+
+
+loaders = {
+    'glove': ('embeddings.glove', 'GloveEmbedding', dict(name='wikipedia_gigaword', d_emb=100)),
+    'fasttext': ('embeddings.fasttext', 'FastTextEmbedding', dict(lang='en')),
+    'numberbatch': ('embeddings.numberbatch', 'NumberbatchEmbedding', dict(name='1908-en')),
+    'kazuma': ('embeddings.kazuma', 'KazumaCharEmbedding', dict()),
+}
+modes = {
+    'sqlite': dict(backend='sqlite'),
+    'mmap': dict(backend='mmap'),
+    'mmap-float16': dict(backend='mmap', quantization='float16'),
+    'mmap-int8': dict(backend='mmap', quantization='int8'),
+    'mmap-pq': dict(backend='mmap', quantization='pq'),
+}
+# Kazuma embeddings are averages of ngrams that are only stored in SQLite.
+loader_modes = {name: ['sqlite'] if name == 'kazuma' else list(modes) for name in loaders}
+
+
+def max_rss_mb():
+    # ru_maxrss of a process started by a large parent can start at the size of the parent, unlike VmHWM, which exec resets
+    if os.path.isfile('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / (1 << 10)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kibibytes on Linux, bytes on macOS
+    return rss / (1 << 20) if sys.platform == 'darwin' else rss / (1 << 10)
+
+
+def make_vocab(n_words, seed=0):
+    rng = random.Random(seed)
+    vocab = set()
+    while len(vocab) < n_words:
+        vocab.add(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 10))))
+    return sorted(vocab)
+
+
+def vec_lines(words, d_emb, seed=0):
+    embs = np.random.RandomState(seed).uniform(-1, 1, (len(words), d_emb)).astype(np.float32)
+    return ''.join('{} {}\n'.format(w, ' '.join('{:.5f}'.format(x) for x in e)) for w, e in zip(words, embs)).encode()
+
+
+def write_archives(root, vocab):
+    """
+    Writes an archive for every loader into ``root``, at the location and in the format the loader downloads.
+    """
+    from embeddings.kazuma import KazumaCharEmbedding
+    os.makedirs(os.path.join(root, 'glove'))
+    with zipfile.ZipFile(os.path.join(root, 'glove', 'wikipedia_gigaword.zip'), 'w') as f:
+        f.writestr('glove.6B.100d.txt', vec_lines(vocab, 100))
+    os.makedirs(os.path.join(root, 'fasttext'))
+    with zipfile.ZipFile(os.path.join(root, 'fasttext', 'en.zip'), 'w') as f:
+        f.writestr('wiki.en.vec', '{} 300\n'.format(len(vocab)).encode() + vec_lines(vocab, 300))
+    os.makedirs(os.path.join(root, 'numberbatch'))
+    with gzip.open(os.path.join(root, 'numberbatch', '1908-en.zip'), 'wb') as f:
+        f.write('{} 300\n'.format(len(vocab)).encode() + vec_lines(['/c/en/{}'.format(w) for w in vocab], 300))
+    grams = list(dict.fromkeys(g for w in vocab for g in KazumaCharEmbedding.grams(w)))
+    content = vec_lines(grams, 100)
+    with tarfile.open(os.path.join(root, 'kazuma.tar.gz'), 'w:gz') as f:
+        info = tarfile.TarInfo('charNgram.txt')
+        info.size = len(content)
+        f.addfile(info, io.BytesIO(content))
+    return dict(glove=len(vocab), fasttext=len(vocab), numberbatch=len(vocab), kazuma=len(grams))
+
+
+def run(loader, mode, phase, samples):
+    """
+    Runs one phase of one configuration in this process and returns its measurements.
+    """
+    start = time.perf_counter()
+    module, cls, kwargs = loaders[loader]
+    cls = getattr(__import__(module, fromlist=[cls]), cls)
+    kwargs = dict(kwargs, show_progress=False, **({} if loader == 'kazuma' else modes[mode]))
+    e = cls(**kwargs)
+    elapsed = time.perf_counter() - start
+    if phase == 'build':
+        return dict(ingest_s=elapsed, max_rss_mb=max_rss_mb())
+
+    if loader == 'numberbatch':
+        samples = ['/c/en/{}'.format(w) for w in samples]
+    times = np.empty(len(samples))
+    for i, w in enumerate(samples):
+        t = time.perf_counter()
+        e.emb(w)
+        times[i] = time.perf_counter() - t
+    p50, p95, p99 = np.percentile(times, [50, 95, 99]) * 1e6
+    batch_size = 1000
+    t = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        e.emb_batch(samples[i:i+batch_size])
+    batch = len(samples) / (time.perf_counter() - t)
+    return dict(startup_ms=elapsed * 1e3, lookup_p50_us=p50, lookup_p95_us=p95, lookup_p99_us=p99, batch_words_per_s=batch, max_rss_mb=max_rss_mb())
+
+
+def run_child(root, loader, mode, phase, samples_file):
+    env = dict(os.environ, EMBEDDINGS_ROOT=root, PYTHONPATH=repo)
+    cmd = [sys.executable, os.path.abspath(__file__), '--run', loader, mode, phase, samples_file]
+    out = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if out.returncode:
+        raise RuntimeError('{} {} {} failed:\n{}'.format(loader, mode, phase, out.stderr))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def compare(results, baseline):
+    old = {(r['loader'], r['mode']): r for r in baseline['results']}
+    keys = ['ingest_rows_per_s', 'startup_ms', 'lookup_p50_us', 'lookup_p99_us', 'batch_words_per_s', 'query_max_rss_mb']
+    print('\nchange against baseline (higher is better for rates, lower for the rest)')
+    print('{:<26}'.format('') + ''.join('{:>20}'.format(k) for k in keys))
+    for r in results:
+        o = old.get((r['loader'], r['mode']))
+        if o is None:
+            continue
+        print('{:<26}'.format('{} {}'.format(r['loader'], r['mode'])) + ''.join('{:>19.1f}%'.format(100 * (r[k] / o[k] - 1)) for k in keys))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == '--run':
+        loader, mode, phase, samples_file = sys.argv[2:6]
+        with open(samples_file) as f:
+            samples = json.load(f)
+        print(json.dumps(run(loader, mode, phase, samples)))
+        sys.exit(0)
+
+    parser = argparse.ArgumentParser(description='offline benchmark of every backend on synthetic archives')
+    parser.add_argument('--words', type=int, default=20000, help='number of words in each archive')
+    parser.add_argument('--samples', type=int, default=10000, help='number of single lookups')
+    parser.add_argument('--loaders', nargs='+', default=list(loaders), choices=list(loaders))
+    parser.add_argument('--modes', nargs='+', default=list(modes), choices=list(modes))
+    parser.add_argument('--out', default='benchmark.json', help='file to write the results to')
+    parser.add_argument('--baseline', help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp()
+    try:
+        vocab = make_vocab(args.words)
+        rows = write_archives(root, vocab)
+        rng = random.Random(0)
+        samples = [rng.choice(vocab) if rng.random() < 0.9 else 'oov{}'.format(i) for i in range(args.samples)]
+        samples_file = os.path.join(root, 'samples.json')
+        with open(samples_file, 'w') as f:
+            json.dump(samples, f)
+
+        results = []
+        print('{:<26}{:>12}{:>10}{:>12}{:>10}{:>10}{:>10}{:>14}{:>10}'.format(
+            'configuration', 'ingest/s', 'build MB', 'startup ms', 'p50 us', 'p95 us', 'p99 us', 'batch words/s', 'query MB'))
+        for loader in args.loaders:
+            for mode in loader_modes[loader]:
+                if mode not in args.modes:
+                    continue
+                build = run_child(root, loader, mode, 'build', samples_file)
+                query = run_child(root, loader, mode, 'query', samples_file)
+                r = dict(
+                    loader=loader, mode=mode, rows=rows[loader],
+                    ingest_s=build['ingest_s'], ingest_rows_per_s=rows[loader] / build['ingest_s'], build_max_rss_mb=build['max_rss_mb'],
+                    startup_ms=query['startup_ms'], lookup_p50_us=query['lookup_p50_us'], lookup_p95_us=query['lookup_p95_us'],
+                    lookup_p99_us=query['lookup_p99_us'], batch_words_per_s=query['batch_words_per_s'], query_max_rss_mb=query['max_rss_mb'],
+                )
+                results.append(r)
+                print('{:<26}{:>12.0f}{:>10.1f}{:>12.1f}{:>10.1f}{:>10.1f}{:>10.1f}{:>14.0f}{:>10.1f}'.format(
+                    '{} {}'.format(loader, mode), r['ingest_rows_per_s'], r['build_max_rss_mb'], r['startup_ms'],
+                    r['lookup_p50_us'], r['lookup_p95_us'], r['lookup_p99_us'], r['batch_words_per_s'], r['query_max_rss_mb']))
+    finally:
+        shutil.rmtree(root)
+
+    import embeddings
+    meta = dict(
+        version=embeddings.__version__, source=os.path.dirname(embeddings.__file__), python=platform.python_version(), numpy=np.__version__, platform=platform.platform(),
+        cpus=os.cpu_count(), words=args.words, samples=args.samples, time=time.strftime('%Y-%m-%dT%H:%M:%S'),
+    )
+    with open(args.out, 'w') as f:
+        json.dump(dict(meta=meta, results=results), f, indent=2)
+    print('wrote {}'.format(args.out))
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from embeddings.matrix import MatrixStore, MatrixWriter  # noqa: E402
+
+
+if __name__ == '__main__':
+    random.seed(0)
+    n_words, d_emb, n_samples = 100000, 300, 10000
+    embs = np.random.RandomState(0).randn(n_words, d_emb).astype(np.float32)
+    words = ['w{}'.format(i) for i in range(n_words)]
+    samples = [random.choice(words) for i in range(n_samples)]
+    root = tempfile.mkdtemp()
+    print('{:<10}{:>12}{:>12}{:>12}{:>16}'.format('mode', 'bytes/word', 'rel error', 'cosine', 'lookup (us)'))
+    for quantization in ['float32', 'float16', 'int8', 'pq']:
+        dname = '{}/{}'.format(root, quantization)
+        with MatrixWriter(dname, d_emb, quantization=quantization) as w:
+            w.insert_matrix(words, embs)
+        store = MatrixStore(dname)
+        error = store.codec.reconstruction_error(embs[:10000])
+        start = time.time()
+        for w in samples:
+            store.lookup(w)
+        lookup = (time.time() - start) / n_samples * 1e6
+        bytes_per_word = store.codes.itemsize * store.codec.code_size
+        print('{:<10}{:>12}{:>12.4f}{:>12.4f}{:>16.1f}'.format(quantization, bytes_per_word, error['relative_error'], error['cosine'], lookup))
+        store.close()
+    shutil.rmtree(root)
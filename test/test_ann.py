@@ -0,0 +1,43 @@
+from embeddings.ann import IVFIndex, kmeans
+from embeddings.similarity import normalize
+import numpy as np
+import unittest
+import shutil
+import os
+
+
+class TestANN(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        self.dname = os.path.join(self.root, 'myindex.ivf')
+        rng = np.random.RandomState(0)
+        centers = rng.randn(20, 16)
+        self.vectors = normalize((centers[rng.randint(20, size=2000)] + 0.1 * rng.randn(2000, 16)).astype(np.float32))
+
+    def tearDown(self):
+        if os.path.isdir(self.dname):
+            shutil.rmtree(self.dname)
+
+    def test_kmeans(self):
+        centroids = kmeans(self.vectors, 20)
+        self.assertEqual((20, 16), centroids.shape)
+        np.testing.assert_allclose(np.ones(20), np.linalg.norm(centroids, axis=1), rtol=1e-5)
+
+    def test_index(self):
+        index = IVFIndex.build(self.dname, self.vectors, n_lists=20)
+        self.assertTrue(IVFIndex.exists(self.dname))
+        self.assertGreater(index.meta['recall']['recall'], 0.9)
+        self.assertEqual(1., index.recall(self.vectors[:50], k=10, nprobe=20))
+        index = IVFIndex(self.dname)
+        results = index.search(self.vectors[:3], k=5, nprobe=2, exclude=np.array([0, -1, 2]))
+        self.assertEqual(3, len(results))
+        scores, rows = results[0]
+        self.assertEqual(5, len(rows))
+        self.assertNotIn(0, rows.tolist())
+        self.assertEqual(1, results[1][1][0])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+from embeddings.embedding import Embedding
+from embeddings.concat import ConcatEmbedding
+from embeddings.kazuma import KazumaCharEmbedding
+import asyncio
+import unittest
+import time
+import os
+
+
+class TestAsync(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.e = Embedding()
+        self.e.d_emb = 3
+        self.e.db = self.e.initialize_db(self.e.path('async.db'))
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+
+    def tearDown(self):
+        self.e.close_async()
+        self.e.db.close()
+        os.remove(self.e.path('async.db'))
+
+    def test_lookup(self):
+        async def main():
+            return await asyncio.gather(
+                self.e.alookup('hello'),
+                self.e.aemb('worlds', default='zero'),
+                *[self.e.aemb('world') for _ in range(100)],
+            )
+        results = asyncio.run(main())
+        self.assertListEqual([1, 2, 3], results[0])
+        self.assertListEqual([0, 0, 0], results[1])
+        self.assertTrue(all(r == [2, 3, 4] for r in results[2:]))
+        embs, oov = asyncio.run(self.e.aemb_batch(['hello', 'worlds'], default='zero'))
+        self.assertListEqual([[1, 2, 3], [0, 0, 0]], embs.tolist())
+        self.assertListEqual([False, True], oov.tolist())
+
+    def test_concat(self):
+        other = Embedding()
+        other.d_emb = 2
+        other.db = other.initialize_db(':memory:')
+        other.insert_batch([('hello', [5, 6])])
+        c = ConcatEmbedding([self.e, other], default='zero')
+        try:
+            self.assertListEqual([1, 2, 3, 5, 6], asyncio.run(c.aemb('hello')))
+            embs, oov = asyncio.run(c.aemb_batch(['hello', 'world']))
+            self.assertListEqual([[1, 2, 3, 5, 6], [2, 3, 4, 0, 0]], embs.tolist())
+        finally:
+            c.close_async()
+
+    def test_kazuma(self):
+        k = KazumaCharEmbedding.__new__(KazumaCharEmbedding)
+        k.d_emb = 2
+        k.db = k.initialize_db(self.e.path('async_kazuma.db'))
+        k.insert_batch([('2gram-#BEGIN#a', [1, 2]), ('2gram-ab', [3, 4])])
+        try:
+            self.assertListEqual([2, 3], asyncio.run(k.aemb('ab')))
+            embs, oov = asyncio.run(k.aemb_batch(['ab', 'zz']))
+            self.assertListEqual([[2, 3], [0, 0]], embs.tolist())
+            self.assertListEqual([False, True], oov.tolist())
+        finally:
+            k.close_async()
+            k.db.close()
+            os.remove(k.path('async_kazuma.db'))
+
+    slow = 'with recursive n(i) as (select 1 union all select i + 1 from n) select count(*) from (select i from n limit 1000000000)'
+
+    def test_timeout(self):
+        self.e.async_workers = 1
+        slow = self.slow
+
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await self.e.run_async(lambda: self.e.reader().execute(slow).fetchone(), timeout=0.1)
+            start = time.time()
+            # the interrupted query frees the only thread
+            self.assertListEqual([1, 2, 3], await self.e.alookup('hello', timeout=5))
+            return time.time() - start
+        self.assertLess(asyncio.run(main()), 5)
+
+    def test_concat_timeout(self):
+        slow_query = self.slow
+
+        class SlowEmbedding(Embedding):
+            def emb_batch(self, words, default=None, out=None):
+                if 'slow' in words:
+                    self.reader().execute(slow_query).fetchone()
+                return super().emb_batch(words, default=default, out=out)
+
+        other = SlowEmbedding()
+        other.d_emb = 2
+        other.db = other.initialize_db(self.e.path('async_slow.db'))
+        other.insert_batch([('hello', [5, 6])])
+        c = ConcatEmbedding([self.e, other], default='zero')
+        c.async_workers = 1
+
+        async def main():
+            with self.assertRaises(asyncio.TimeoutError):
+                await c.aemb_batch(['slow'], timeout=0.2)
+            start = time.time()
+            # the query of the sub-embedding was interrupted too, which frees the only thread
+            embs, oov = await c.aemb_batch(['hello'], timeout=5)
+            self.assertListEqual([[1, 2, 3, 5, 6]], embs.tolist())
+            return time.time() - start
+        try:
+            self.assertLess(asyncio.run(main()), 5)
+        finally:
+            c.close()
+            other.db.close()
+            os.remove(other.path('async_slow.db'))
+
+    def test_responsive(self):
+        self.e.async_workers = 2
+
+        async def main():
+            ticks = 0
+
+            async def ticker():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0)
+            t = asyncio.create_task(ticker())
+            await asyncio.gather(*[self.e.run_async(time.sleep, 0.01) for _ in range(10)])
+            t.cancel()
+            return ticks
+        self.assertGreater(asyncio.run(main()), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
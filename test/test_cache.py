@@ -0,0 +1,42 @@
+from embeddings.cache import LRUCache
+import threading
+import unittest
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_eviction(self):
+        c = LRUCache(maxsize=2)
+        c.put('a', 1)
+        c.put('b', 2)
+        self.assertEqual((True, 1), c.get('a'))
+        c.put('c', 3)
+        self.assertEqual((False, None), c.get('b'))
+        self.assertEqual((True, 3), c.get('c'))
+        self.assertEqual(dict(hits=2, misses=1, evictions=1, size=2, maxsize=2), c.stats())
+
+    def test_none_value(self):
+        c = LRUCache(maxsize=2)
+        c.put('a', None)
+        self.assertEqual((True, None), c.get('a'))
+
+    def test_threads(self):
+        c = LRUCache(maxsize=50)
+
+        def work(offset):
+            for i in range(1000):
+                c.put((offset + i) % 100, i)
+                c.get(i % 100)
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = c.stats()
+        self.assertEqual(8000, stats['hits'] + stats['misses'])
+        self.assertEqual(50, stats['size'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+from embeddings.download import download, file_digest
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from functools import partial
+import threading
+import hashlib
+import unittest
+import shutil
+import os
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files with support for single byte ranges, which ``SimpleHTTPRequestHandler`` lacks.
+    """
+
+    ranges = True
+    requests = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        fname = self.translate_path(self.path)
+        self.requests.append((self.command, self.headers.get('Range')))
+        if not os.path.isfile(fname):
+            self.send_error(404)
+            return None
+        size = os.path.getsize(fname)
+        start, end = 0, size - 1
+        rng = self.headers.get('Range') if self.ranges else None
+        if rng:
+            a, b = rng[len('bytes='):].split('-')
+            start, end = int(a), min(int(b) if b else size - 1, size - 1)
+            if start >= size:
+                self.send_error(416)
+                return None
+        f = open(fname, 'rb')
+        f.seek(start)
+        self.remaining = end - start + 1
+        self.send_response(206 if rng else 200)
+        if self.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        if rng:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end, size))
+        self.send_header('Content-Length', str(self.remaining))
+        self.end_headers()
+        return f
+
+    def copyfile(self, source, outputfile):
+        outputfile.write(source.read(self.remaining))
+
+
+class TestDownload(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root', 'download')
+        self.served = os.path.join(self.root, 'served')
+        os.makedirs(self.served, exist_ok=True)
+        self.content = os.urandom(300000)
+        with open(os.path.join(self.served, 'emb.zip'), 'wb') as f:
+            f.write(self.content)
+        RangeHandler.ranges = True
+        RangeHandler.requests = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(RangeHandler, directory=self.served))
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/emb.zip'.format(self.server.server_address[1])
+        self.fname = os.path.join(self.root, 'out', 'emb.zip')
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def read(self):
+        with open(self.fname, 'rb') as f:
+            return f.read()
+
+    def test_parallel(self):
+        sha256 = hashlib.sha256(self.content).hexdigest()
+        download(self.url, self.fname, sha256=sha256, workers=4, part_size=65536)
+        self.assertEqual(self.content, self.read())
+        self.assertEqual(sha256, file_digest(self.fname))
+        self.assertEqual(5, len([r for c, r in RangeHandler.requests if c == 'GET' and r]))
+        self.assertFalse(os.path.exists(self.fname + '.part'))
+        self.assertFalse(os.path.exists(self.fname + '.part.json'))
+
+    def test_resume_parts(self):
+        os.makedirs(os.path.dirname(self.fname))
+        with open(self.fname + '.part', 'wb') as f:
+            f.write(self.content[:65536] + bytes(len(self.content) - 65536))
+        with open(self.fname + '.part.json', 'w') as f:
+            f.write('{"size": 300000, "part_size": 65536, "done": [0]}')
+        download(self.url, self.fname, workers=2, part_size=65536)
+        self.assertEqual(self.content, self.read())
+        self.assertNotIn('bytes=0-65535', [r for c, r in RangeHandler.requests])
+
+    def test_resume(self):
+        os.makedirs(os.path.dirname(self.fname))
+        with open(self.fname + '.part', 'wb') as f:
+            f.write(self.content[:1000])
+        download(self.url, self.fname, workers=1)
+        self.assertEqual(self.content, self.read())
+        self.assertIn(('GET', 'bytes=1000-'), RangeHandler.requests)
+
+    def test_no_ranges(self):
+        RangeHandler.ranges = False
+        os.makedirs(os.path.dirname(self.fname))
+        with open(self.fname + '.part', 'wb') as f:
+            f.write(b'garbage')
+        download(self.url, self.fname, workers=4, part_size=65536)
+        self.assertEqual(self.content, self.read())
+
+    def test_verify(self):
+        with self.assertRaises(IOError):
+            download(self.url, self.fname, sha256='0' * 64)
+        self.assertFalse(os.path.exists(self.fname))
+        self.assertFalse(os.path.exists(self.fname + '.part'))
+        with self.assertRaises(IOError):
+            download(self.url, self.fname, size=len(self.content) + 1, workers=1)
+        self.assertFalse(os.path.exists(self.fname))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
 from embeddings.embedding import Embedding
+from embeddings.kazuma import KazumaCharEmbedding
+from embeddings.concat import ConcatEmbedding
+import numpy as np
 import unittest
+import threading
+import tempfile
+import shutil
 import os
 
 
@@ -17,6 +23,9 @@ class TestEmbeddings(unittest.TestCase):
         fdb = self.e.path('mydb.db')
         if os.path.isfile(fdb):
             os.remove(fdb)
+        for suffix in ['.norm', '.ivf']:
+            if os.path.isdir(fdb + suffix):
+                shutil.rmtree(fdb + suffix)
 
     def test_path(self):
         self.assertEqual(os.path.join(self.root, 'foobar'), self.e.path('foobar'))
@@ -48,6 +57,261 @@ class TestEmbeddings(unittest.TestCase):
         self.assertEqual(3, len(self.e))
         self.assertListEqual([2, 3, 4], self.e.lookup('world'))
 
+    def test_short_entries(self):
+        # databases built before header lines were skipped hold them as entries with fewer dimensions
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3]), ('', [2, 300])])
+        self.assertIsNone(self.e.lookup(''))
+        embs, oov = self.e.lookup_batch(['', 'hello'])
+        self.assertListEqual([True, False], oov.tolist())
+        self.assertListEqual([[0, 0, 0], [1, 2, 3]], embs.tolist())
+
+    def test_metadata(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+        self.assertFalse(self.e.is_complete())
+        self.assertTrue(self.e.is_complete(size=2))
+        self.assertEqual(dict(complete='1', size='2', d_emb='3', url=None, schema_version='1'), self.e.metadata())
+        self.e.db.execute("update metadata set value = '5' where key = 'size'")
+        self.assertEqual(5, len(self.e))
+        self.e.insert_batch([('!', [3, 4, 5])])
+        self.assertEqual(3, len(self.e))
+        self.assertTrue(self.e.is_complete())
+        self.e.mark_complete(url='http://example.com/e.zip')
+        self.assertEqual('http://example.com/e.zip', self.e.metadata()['url'])
+        self.e.schema_version = 2
+        self.assertFalse(self.e.is_complete())
+        self.e.clear()
+        self.assertEqual({}, self.e.metadata())
+
+    def test_bulk_load(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        with self.e.bulk_load():
+            self.e.insert_batch([('hello', [1, 2, 3])])
+            self.e.insert_batch([('world', [2, 3, 4])])
+            self.assertTrue(self.e.db.in_transaction)
+        self.assertFalse(self.e.db.in_transaction)
+        self.assertEqual(2, len(self.e))
+        self.assertEqual('delete', self.e.db.execute('pragma journal_mode').fetchone()[0])
+        with self.assertRaises(ValueError):
+            with self.e.bulk_load():
+                self.e.insert_batch([('!', [3, 4, 5])])
+                raise ValueError()
+        self.assertEqual(2, len(self.e))
+
+    def test_load_memory(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+        self.e.load_memory()
+        self.assertEqual(2, len(self.e))
+        self.assertListEqual([2, 3, 4], self.e.lookup('world'))
+        self.assertListEqual([[1, 2, 3]], self.e.lookup_batch(['hello'])[0].tolist())
+
+    def test_most_similar(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([
+            ('cat', [1, 0, 0]),
+            ('dog', [0.9, 0.1, 0]),
+            ('car', [0, 1, 0]),
+            ('bus', [0.1, 0.8, 0.2]),
+            ('!', [0, 0, 0]),
+        ])
+        self.assertAlmostEqual(1, self.e.similarity('cat', 'cat'), places=5)
+        self.assertAlmostEqual(0, self.e.similarity('cat', 'car'), places=5)
+        self.assertIsNone(self.e.similarity('cat', 'cats'))
+        self.assertListEqual(['dog', 'bus'], [w for w, s in self.e.most_similar('cat', k=2)])
+        self.assertListEqual(['car', 'bus'], [w for w, s in self.e.most_similar([0, 2, 0], k=2)])
+        self.assertIsNone(self.e.most_similar('cats'))
+        self.assertEqual(4, len(self.e.most_similar('cat', k=10)))
+        batch = self.e.most_similar_batch(['car', 'cats', [1, 0, 0]], k=1)
+        self.assertEqual('bus', batch[0][0][0])
+        self.assertIsNone(batch[1])
+        self.assertEqual('cat', batch[2][0][0])
+        self.assertTrue(os.path.isdir(self.e.path('mydb.db.norm')))
+        self.assertListEqual(['dog', 'bus'], [w for w, s in self.e.most_similar('cat', k=2, nprobe=8)])
+        self.assertTrue(os.path.isdir(self.e.path('mydb.db.ivf')))
+
+    def test_most_similar_rebuilt(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([('cat', [1, 0, 0]), ('dog', [0.9, 0.1, 0]), ('car', [0, 1, 0])])
+        self.assertEqual('dog', self.e.most_similar('cat', k=1)[0][0])
+        self.e.db.close()
+        # a store rebuilt with as many embeddings does not reuse the saved normalized copy
+        os.remove(self.e.path('mydb.db'))
+        e = Embedding()
+        e.db = e.initialize_db(e.path('mydb.db'))
+        e.insert_batch([('cat', [1, 0, 0]), ('dog', [0, 1, 0]), ('car', [0.9, 0.1, 0])])
+        os.utime(e.path('mydb.db'), ns=(0, os.stat(e.path('mydb.db')).st_mtime_ns + 10 ** 9))
+        self.assertEqual('car', e.most_similar('cat', k=1)[0][0])
+        self.assertEqual('car', e.most_similar('cat', k=1, nprobe=8)[0][0])
+        e.db.close()
+
+    def test_most_similar_in_memory(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([('cat', [1, 0, 0]), ('dog', [0.9, 0.1, 0]), ('car', [0, 1, 0])])
+        self.e.load_memory()
+        tmp = set(os.listdir(tempfile.gettempdir()))
+        self.assertEqual('dog', self.e.most_similar('cat', k=1)[0][0])
+        self.assertEqual('dog', self.e.most_similar('cat', k=1, nprobe=8)[0][0])
+        # nothing is left on disk for embeddings without a store
+        self.assertEqual(tmp, set(os.listdir(tempfile.gettempdir())))
+
+    def test_cache(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([('hello', [1, 2, 3])])
+        cache = self.e.enable_cache(maxsize=10)
+        for _ in range(3):
+            self.assertListEqual([1, 2, 3], self.e.lookup('hello'))
+            self.assertIsNone(self.e.lookup('world'))
+        self.assertEqual(4, cache.stats()['hits'])
+        self.assertEqual(2, cache.stats()['misses'])
+        self.e.lookup('hello').append(4)
+        self.assertListEqual([1, 2, 3], self.e.lookup('hello'))
+        self.e.insert_batch([('world', [2, 3, 4])])
+        self.assertListEqual([2, 3, 4], self.e.lookup('world'))
+
+    def test_as_numpy(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3])])
+        e = self.e.lookup('hello', as_numpy=True)
+        self.assertEqual(np.float32, e.dtype)
+        self.assertListEqual([1, 2, 3], e.tolist())
+        self.assertFalse(e.flags.writeable)
+        self.assertIsNone(self.e.lookup('world', as_numpy=True))
+        self.assertIsNone(self.e.emb('world', as_numpy=True))
+        self.assertListEqual([None] * 3, self.e.emb('world'))
+        self.assertListEqual([0, 0, 0], self.e.emb('world', default='zero', as_numpy=True).tolist())
+        self.assertEqual(np.float32, self.e.emb('world', default='random', as_numpy=True).dtype)
+        self.e.as_numpy = True
+        self.e.enable_cache(maxsize=10)
+        for _ in range(2):
+            self.assertListEqual([1, 2, 3], self.e.emb('hello').tolist())
+        self.assertListEqual([1, 2, 3], self.e.lookup('hello', as_numpy=False))
+
+    def test_lookup_batch(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([
+            ('hello', [1, 2, 3]),
+            ('world', [2, 3, 4]),
+        ])
+        embs, oov = self.e.lookup_batch(['world', 'worlds', 'hello', 'world'])
+        self.assertEqual(np.float32, embs.dtype)
+        self.assertListEqual([[2, 3, 4], [0, 0, 0], [1, 2, 3], [2, 3, 4]], embs.tolist())
+        self.assertListEqual([False, True, False, False], oov.tolist())
+
+    def test_emb_batch(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.insert_batch([('hello', [1, 2, 3])])
+        embs, oov = self.e.emb_batch(['hello', 'worlds'], default='zero')
+        self.assertListEqual([[1, 2, 3], [0, 0, 0]], embs.tolist())
+        embs, oov = self.e.emb_batch(['hello', 'worlds'], default='random')
+        self.assertTrue(np.all(np.abs(embs[1]) <= 0.1))
+        embs, oov = self.e.emb_batch(['hello', 'worlds'], default='none')
+        self.assertTrue(np.isnan(embs[1]).all())
+
+    def test_hash_default(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3])])
+        e = self.e.emb('worlds', default='hash')
+        self.assertListEqual(e, self.e.emb('worlds', default='hash'))
+        self.assertTrue(np.all(np.abs(e) <= 0.1))
+        embs, oov = self.e.emb_batch(['hello', 'worlds', '?'], default='hash')
+        self.assertListEqual([1, 2, 3], embs[0].tolist())
+        np.testing.assert_array_equal(self.e.emb('worlds', default='hash', as_numpy=True), embs[1])
+        self.assertFalse(np.allclose(embs[1], embs[2]))
+        self.e.enable_cache(maxsize=10, oov_maxsize=10)
+        for _ in range(3):
+            self.assertListEqual(e, self.e.emb('worlds', default='hash'))
+        self.assertEqual(2, self.e.oov_cache.stats()['hits'])
+        self.e.hash_seed = 1
+        self.e.disable_cache()
+        self.assertNotEqual(e, self.e.emb('worlds', default='hash'))
+
+    def test_concat_emb_batch(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+        other = Embedding()
+        other.d_emb = 2
+        other.db = other.initialize_db(':memory:')
+        other.insert_batch([('hello', [5, 6]), ('!', [7, 8])])
+        for parallel in [True, False]:
+            c = ConcatEmbedding([self.e, other], default='zero', parallel=parallel)
+            embs, oov = c.emb_batch(['hello', 'world', '!', '?'])
+            self.assertListEqual([[1, 2, 3, 5, 6], [2, 3, 4, 0, 0], [0, 0, 0, 7, 8], [0, 0, 0, 0, 0]], embs.tolist())
+            self.assertListEqual([False, True, True, True], oov.tolist())
+            out = np.full((6, 6), -1, dtype=np.float32)
+            c.lookup_batch(['hello', 'world', '!', '?', 'hello', 'world'], out=out[:, 1:])
+            self.assertListEqual([-1] * 6, out[:, 0].tolist())
+            self.assertListEqual([2, 3, 4, 0, 0], out[5, 1:].tolist())
+            self.assertListEqual([1, 2, 3, 5, 6], c.emb('hello', as_numpy=True).tolist())
+            self.assertListEqual([2, 3, 4, 0, 0], c.emb('world', as_numpy=True).tolist())
+            c.close()
+            self.assertIsNone(c.executor)
+            self.assertFalse(any(t.name.startswith('embeddings-concat') for t in threading.enumerate()))
+            # the threads are created again by the next batch call
+            self.assertListEqual([False, True], c.emb_batch(['hello', 'world'])[1].tolist())
+            c.close()
+
+    def test_concat_materialize(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.d_emb = 3
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+        other = Embedding()
+        other.d_emb = 2
+        other.db = other.initialize_db(':memory:')
+        other.insert_batch([('hello', [5, 6]), ('world', [7, 8]), ('!', [9, 10])])
+        c = ConcatEmbedding([self.e, other], default='zero')
+        try:
+            store = c.materialize('mytest', words=['hello', '!', 'hello'])
+            self.assertEqual(1, len(store))
+            self.e.insert_batch([('!', [0, 1, 2])])
+            other.clear()
+            embs, oov = c.emb_batch(['hello', 'world', '!'])
+            self.assertListEqual([[1, 2, 3, 5, 6], [2, 3, 4, 0, 0], [0, 1, 2, 0, 0]], embs.tolist())
+            self.assertListEqual([False, True, True], oov.tolist())
+            self.assertListEqual([1, 2, 3, 5, 6], c.emb('hello'))
+            # lookups are not served from the store
+            embs, oov = c.lookup_batch(['hello'])
+            self.assertListEqual([[1, 2, 3, 0, 0]], embs.tolist())
+            self.assertListEqual([True], oov.tolist())
+            # a store built from other embeddings is not reused
+            wide = Embedding()
+            wide.d_emb = 4
+            wide.db = wide.initialize_db(':memory:')
+            wide.insert_batch([('hello', [5, 6, 7, 8])])
+            c = ConcatEmbedding([self.e, wide], default='zero')
+            with self.assertRaises(AssertionError):
+                c.materialize('mytest')
+            store = c.materialize('mytest', words=['hello'])
+            self.assertEqual(7, store.d_emb)
+            self.assertListEqual([1, 2, 3, 5, 6, 7, 8], c.emb('hello'))
+            # a matching store is reopened without words
+            self.assertEqual(1, len(ConcatEmbedding([self.e, wide]).materialize('mytest')))
+        finally:
+            shutil.rmtree(self.e.path('concat'))
+
+    def test_kazuma_emb_batch(self):
+        k = KazumaCharEmbedding.__new__(KazumaCharEmbedding)
+        k.d_emb = 2
+        k.db = k.initialize_db(self.e.path('mydb.db'))
+        k.insert_batch([
+            ('2gram-#BEGIN#a', [1, 2]),
+            ('2gram-ab', [3, 4]),
+            ('3gram-ab#END#', [5, 6]),
+        ])
+        embs, oov = k.emb_batch(['ab', 'zab', 'zz'])
+        self.assertListEqual([[3, 4], [4, 5], [0, 0]], embs.tolist())
+        for i, w in enumerate(['ab', 'zab', 'zz']):
+            self.assertListEqual(k.emb(w), embs[i].tolist())
+            self.assertListEqual(k.emb(w, as_numpy=True).tolist(), embs[i].tolist())
+        self.assertListEqual([False, False, True], oov.tolist())
+        k.db.close()
+
 
 if __name__ == '__main__':
     unittest.main()
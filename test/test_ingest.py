@@ -0,0 +1,52 @@
+from embeddings.embedding import Embedding
+from embeddings.ingest import parse_line, parse_token_line, parse_lines
+import unittest
+import os
+
+
+class TestIngest(unittest.TestCase):
+
+    lines = [
+        b'hello 1 2 3\n',
+        b'new york 2 3 4\n',
+        b'hello 5 6 7\n',
+        b'! 3 4 5.5\n',
+    ] * 3
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.e = Embedding()
+        self.e.d_emb = 3
+
+    def tearDown(self):
+        fdb = self.e.path('mydb.db')
+        if os.path.isfile(fdb):
+            os.remove(fdb)
+
+    def test_parse_line(self):
+        word, emb = parse_line(b'new york 2 3 4.5\n', 3)
+        self.assertEqual('new york', word)
+        self.assertEqual(12, len(emb))
+        word, emb = parse_token_line(b'/c/en/york 2 3 4.5\n', 3)
+        self.assertEqual('/c/en/york', word)
+        self.assertEqual(12, len(emb))
+
+    def test_parse_lines_parallel(self):
+        serial = list(parse_lines(self.lines, parse_line, 3, batch_size=5, workers=1))
+        parallel = list(parse_lines(self.lines, parse_line, 3, batch_size=5, workers=2))
+        self.assertEqual([5, 5, 2], [len(b) for b in serial])
+        self.assertEqual(serial, parallel)
+
+    def test_ingest(self):
+        self.e.db = self.e.initialize_db(self.e.path('mydb.db'))
+        self.e.ingest(iter(self.lines), batch_size=2, workers=2)
+        self.assertEqual(3, len(self.e))
+        self.assertListEqual([1, 2, 3], self.e.lookup('hello'))
+        self.assertListEqual([2, 3, 4], self.e.lookup('new york'))
+        self.assertListEqual([3, 4, 5.5], self.e.lookup('!'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import subprocess
+import unittest
+import sys
+import os
+
+
+class TestInit(unittest.TestCase):
+
+    def imported(self, statement):
+        code = 'import sys; {}; print(" ".join(sorted(sys.modules)))'.format(statement)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, cwd=root)
+        return set(out.stdout.split())
+
+    def test_lazy(self):
+        modules = self.imported('import embeddings')
+        for m in ['numpy', 'requests', 'tqdm', 'embeddings.embedding']:
+            self.assertNotIn(m, modules)
+        modules = self.imported('from embeddings import GloveEmbedding, ConcatEmbedding')
+        self.assertIn('embeddings.glove', modules)
+        self.assertNotIn('embeddings.fasttext', modules)
+        for m in ['requests', 'tqdm']:
+            self.assertNotIn(m, modules)
+
+    def test_attributes(self):
+        import embeddings
+        from embeddings.glove import GloveEmbedding
+        self.assertIs(GloveEmbedding, embeddings.GloveEmbedding)
+        self.assertIn('KazumaCharEmbedding', dir(embeddings))
+        with self.assertRaises(AttributeError):
+            embeddings.FooEmbedding
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,187 @@
+from embeddings.fasttext import FastTextEmbedding
+from embeddings.kazuma import KazumaCharEmbedding
+import unittest
+from unittest import mock
+from array import array
+import sqlite3
+import threading
+import tarfile
+import zipfile
+import shutil
+import io
+import os
+
+
+def vec_line(word, d_emb, value):
+    return '{} {}\n'.format(word, ' '.join([str(value)] * d_emb))
+
+
+class TestLoaders(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def tearDown(self):
+        for name in ['fasttext', 'kazuma.tar.gz', 'kazuma.db', 'kazuma.slim.db']:
+            fname = os.path.join(self.root, name)
+            if os.path.isdir(fname):
+                shutil.rmtree(fname)
+            elif os.path.isfile(fname):
+                os.remove(fname)
+
+    def test_fasttext(self):
+        os.makedirs(os.path.join(self.root, 'fasttext'))
+        with zipfile.ZipFile(os.path.join(self.root, 'fasttext', 'en.zip'), 'w') as f:
+            f.writestr('wiki.en.vec', '2 300\n' + vec_line('canada', 300, 0.25) + vec_line('toronto', 300, 0.5))
+        e = FastTextEmbedding(show_progress=False)
+        self.assertListEqual([0.25] * 300, e.emb('canada'))
+        self.assertListEqual([0.5] * 300, e.emb('toronto'))
+        # the header line is not stored
+        self.assertEqual(2, len(e))
+        embs, oov = e.emb_batch(['', 'canada'], default='zero')
+        self.assertListEqual([True, False], oov.tolist())
+        self.assertListEqual([0.25] * 300, embs[1].tolist())
+        e.db.close()
+
+    def test_fasttext_subset(self):
+        os.makedirs(os.path.join(self.root, 'fasttext'))
+        with zipfile.ZipFile(os.path.join(self.root, 'fasttext', 'en.zip'), 'w') as f:
+            f.writestr('wiki.en.vec', '3 300\n' + vec_line('canada', 300, 0.25) + vec_line('toronto', 300, 0.5) + vec_line('paris', 300, 0.75))
+        e = FastTextEmbedding(show_progress=False)
+        corpus = os.path.join(self.root, 'fasttext', 'corpus.txt')
+        with open(corpus, 'w') as f:
+            f.write('canada toronto\ncanada montreal\n')
+        self.assertEqual(e.path(os.path.join('fasttext', 'en.slim.db')), e.subset('slim', corpus=corpus, batch_size=1))
+        e.subset('slim', words=['toronto', 'paris'], backend='mmap', quantization='float16')
+        e.db.close()
+        # subsets are opened without the full embeddings
+        os.remove(os.path.join(self.root, 'fasttext', 'en.db'))
+        s = FastTextEmbedding(subset='slim', default='zero')
+        self.assertEqual(2, len(s))
+        self.assertListEqual([0.25] * 300, s.emb('canada'))
+        self.assertListEqual([0.] * 300, s.emb('paris'))
+        self.assertEqual('slim', s.metadata()['subset'])
+        s.db.close()
+        m = FastTextEmbedding(subset='slim', backend='mmap', quantization='float16')
+        self.assertEqual(2, len(m))
+        self.assertListEqual([0.75] * 300, m.emb('paris'))
+        with self.assertRaises(IOError):
+            FastTextEmbedding(subset='missing')
+        self.assertFalse(os.path.isfile(os.path.join(self.root, 'fasttext', 'en.db')))
+
+    def test_kazuma(self):
+        content = (vec_line('2gram-#BEGIN#a', 100, 0.25) + vec_line('2gram-a#END#', 100, 0.75)).encode()
+        with tarfile.open(os.path.join(self.root, 'kazuma.tar.gz'), 'w:gz') as f:
+            info = tarfile.TarInfo('charNgram.txt')
+            info.size = len(content)
+            f.addfile(info, io.BytesIO(content))
+        e = KazumaCharEmbedding(show_progress=False)
+        self.assertEqual(2, len(e))
+        self.assertListEqual([0.5] * 100, e.emb('a'))
+        meta = e.metadata()
+        self.assertEqual('1', meta['complete'])
+        self.assertEqual('100', meta['d_emb'])
+        self.assertEqual(KazumaCharEmbedding.url, meta['url'])
+        e.db.close()
+        # a complete database is opened without the archive and without counting it
+        os.remove(os.path.join(self.root, 'kazuma.tar.gz'))
+        size, KazumaCharEmbedding.size = KazumaCharEmbedding.size, 3
+        try:
+            e = KazumaCharEmbedding(show_progress=False)
+            self.assertEqual(2, len(e))
+            e.db.close()
+        finally:
+            KazumaCharEmbedding.size = size
+
+    def test_kazuma_read_only(self):
+        # a database built before the metadata table existed, on a read-only image
+        fname = os.path.join(self.root, 'kazuma.db')
+        db = sqlite3.connect(fname)
+        db.execute('create table embeddings(word text primary key, emb blob)')
+        db.executemany('insert into embeddings values (?, ?)', [
+            ('2gram-#BEGIN#a', array('f', [0.25] * 100).tobytes()), ('2gram-a#END#', array('f', [0.75] * 100).tobytes()),
+        ])
+        db.commit()
+        db.close()
+        with open(fname, 'rb') as f:
+            content = f.read()
+        size, KazumaCharEmbedding.size = KazumaCharEmbedding.size, 2
+        try:
+            with mock.patch('embeddings.embedding.access', return_value=False):
+                e = KazumaCharEmbedding(show_progress=False)
+                self.assertTrue(e.read_only())
+                self.assertEqual(2, len(e))
+                self.assertListEqual([0.5] * 100, e.emb('a'))
+                e.db.close()
+                with self.assertRaises(AssertionError):
+                    KazumaCharEmbedding(show_progress=False, materialize=True)
+        finally:
+            KazumaCharEmbedding.size = size
+        with open(fname, 'rb') as f:
+            self.assertEqual(content, f.read())
+
+    def test_kazuma_materialize(self):
+        content = (vec_line('2gram-#BEGIN#a', 100, 0.25) + vec_line('2gram-a#END#', 100, 0.75)).encode()
+        with tarfile.open(os.path.join(self.root, 'kazuma.tar.gz'), 'w:gz') as f:
+            info = tarfile.TarInfo('charNgram.txt')
+            info.size = len(content)
+            f.addfile(info, io.BytesIO(content))
+        e = KazumaCharEmbedding(show_progress=False, materialize=True)
+        self.assertListEqual([0.5] * 100, e.emb('a'))
+        embs, oov = e.emb_batch(['a', 'zz', 'a'])
+        self.assertListEqual([False, True, False], oov.tolist())
+        self.assertListEqual([0.5] * 100, embs[2].tolist())
+        self.assertEqual(dict(hits=1, misses=2, size=2), e.materialized_stats())
+        corpus = os.path.join(self.root, 'kazuma_corpus.txt')
+        with open(corpus, 'w') as f:
+            f.write('a b\nab zz\n')
+        e.precompute_file(corpus)
+        os.remove(corpus)
+        self.assertEqual(4, e.materialized_stats()['size'])
+
+        # threads share the connection to embed new words concurrently
+        before = e.materialized_stats()
+        words = ['{}{}'.format(c, i) for c in 'ab' for i in range(50)]
+        errors = []
+
+        def work(offset):
+            try:
+                for i in range(len(words)):
+                    e.emb_batch([words[(offset + i) % len(words)], 'a'])
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=work, args=(i * 10,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertListEqual([], errors)
+        stats = e.materialized_stats()
+        self.assertEqual(4 + len(words), stats['size'])
+        self.assertEqual(8 * len(words) * 2, stats['hits'] + stats['misses'] - before['hits'] - before['misses'])
+        e.db.close()
+
+    def test_kazuma_subset(self):
+        content = (vec_line('2gram-#BEGIN#a', 100, 0.25) + vec_line('2gram-a#END#', 100, 0.75) + vec_line('2gram-#BEGIN#b', 100, 1)).encode()
+        with tarfile.open(os.path.join(self.root, 'kazuma.tar.gz'), 'w:gz') as f:
+            info = tarfile.TarInfo('charNgram.txt')
+            info.size = len(content)
+            f.addfile(info, io.BytesIO(content))
+        e = KazumaCharEmbedding(show_progress=False)
+        e.subset('slim', words=['a', 'a'])
+        with self.assertRaises(AssertionError):
+            e.subset('slim', words=['a'], backend='mmap')
+        e.db.close()
+        s = KazumaCharEmbedding(subset='slim')
+        self.assertEqual(2, len(s))
+        self.assertListEqual([0.5] * 100, s.emb('a'))
+        # words outside of the vocabulary are embedded from the ngrams they share with it
+        self.assertListEqual([0.75] * 100, s.emb('ba'))
+        s.db.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
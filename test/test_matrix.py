@@ -0,0 +1,67 @@
+from embeddings.matrix import MatrixStore, MatrixWriter
+from embeddings.glove import GloveEmbedding
+import numpy as np
+import unittest
+import zipfile
+import shutil
+import os
+
+
+class TestMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.dname = os.path.join(self.root, 'mystore.mmap')
+
+    def tearDown(self):
+        for d in [self.dname, os.path.join(self.root, 'glove')]:
+            if os.path.isdir(d):
+                shutil.rmtree(d)
+
+    def test_store(self):
+        with MatrixWriter(self.dname, d_emb=3) as w:
+            w.insert_batch([
+                ('hello', [1, 2, 3]),
+                ('world', [2, 3, 4]),
+                ('hello', [5, 6, 7]),
+                ('1 3', [1, 3]),
+            ])
+            w.insert_batch([('!', [3, 4, 5]), ('héllo', [4, 5, 6])])
+        store = MatrixStore(self.dname)
+        self.assertEqual(4, len(store))
+        self.assertListEqual([1, 2, 3], store.lookup('hello').tolist())
+        self.assertListEqual([4, 5, 6], store.lookup('héllo').tolist())
+        self.assertIsNone(store.lookup('worlds'))
+        embs, oov = store.lookup_batch(['world', 'worlds', '!'])
+        self.assertListEqual([[2, 3, 4], [0, 0, 0], [3, 4, 5]], embs.tolist())
+        self.assertListEqual([False, True, False], oov.tolist())
+        store.load_memory()
+        self.assertListEqual([4, 5, 6], store.lookup('héllo').tolist())
+        self.assertIsNone(store.lookup('worlds'))
+        store.close()
+
+    def test_empty_store(self):
+        with MatrixWriter(self.dname, d_emb=3):
+            pass
+        store = MatrixStore(self.dname)
+        self.assertEqual(0, len(store))
+        self.assertIsNone(store.lookup('hello'))
+        store.close()
+
+    def test_glove_backend(self):
+        os.makedirs(os.path.join(self.root, 'glove'))
+        with zipfile.ZipFile(os.path.join(self.root, 'glove', 'wikipedia_gigaword.zip'), 'w') as f:
+            f.writestr('glove.6B.50d.txt', ''.join('{} {}\n'.format(w, ' '.join(['0.5'] * 50)) for w in ['the', 'new york', 'the']))
+        g = GloveEmbedding('wikipedia_gigaword', d_emb=50, show_progress=False, backend='mmap')
+        self.assertEqual(2, len(g))
+        self.assertListEqual([0.5] * 50, g.emb('new york'))
+        self.assertIsNone(g.emb('canada')[0])
+        embs, oov = g.emb_batch(['the', 'canada'], default='zero')
+        self.assertEqual(np.float32, embs.dtype)
+        self.assertListEqual([False, True], oov.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
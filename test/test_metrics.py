@@ -0,0 +1,118 @@
+from embeddings.embedding import Embedding
+from embeddings.concat import ConcatEmbedding
+from embeddings.kazuma import KazumaCharEmbedding
+from embeddings.metrics import Histogram, Metrics
+import unittest
+import threading
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        h = Histogram()
+        self.assertEqual(0, h.percentile(50))
+        for _ in range(99):
+            h.observe(3e-6)
+        h.observe(1.)
+        s = h.snapshot()
+        self.assertEqual(100, s['count'])
+        self.assertEqual(4e-6, s['p50'])
+        self.assertEqual(4e-6, s['p95'])
+        self.assertEqual(4e-6, s['p99'])
+        self.assertEqual(1., h.percentile(100))
+        self.assertEqual(1., s['max'])
+
+    def test_counters_and_hooks(self):
+        m = Metrics()
+        records = []
+        m.add_hook(lambda kind, name, value: records.append((kind, name, value)))
+        m.incr('a')
+        m.incr('a', 2)
+        with m.timer('t'):
+            pass
+        s = m.snapshot()
+        self.assertEqual(dict(a=3, t=1), s['counters'])
+        self.assertEqual(1, s['histograms']['t']['count'])
+        self.assertEqual([('count', 'a', 1), ('count', 'a', 2)], records[:2])
+        self.assertEqual('latency', records[2][0])
+        m.reset()
+        self.assertEqual(dict(counters={}, histograms={}), m.snapshot())
+
+    def test_threads(self):
+        m = Metrics()
+
+        def work():
+            for _ in range(1000):
+                m.incr('a')
+                m.observe('b', 1e-5)
+
+        threads = [threading.Thread(target=work) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        s = m.snapshot()
+        self.assertEqual(8000, s['counters']['a'])
+        self.assertEqual(8000, s['histograms']['b']['count'])
+
+    def test_embedding(self):
+        e = Embedding()
+        e.d_emb = 2
+        e.db = e.initialize_db(':memory:')
+        e.insert_batch([('hello', [1, 2]), ('world', [3, 4])])
+        e.emb('hello')
+        self.assertIsNone(e.metrics)
+        m = e.enable_metrics(name='e')
+        e.enable_cache(10)
+        e.emb('hello')
+        e.emb('hello')
+        e.emb('foo', default='zero')
+        e.emb_batch(['hello', 'bar'], default='zero')
+        c = m.snapshot()['counters']
+        self.assertEqual(3, c['e.lookup'])
+        self.assertEqual(1, c['e.lookup_oov'])
+        self.assertEqual(1, c['e.cache_hit'])
+        self.assertEqual(2, c['e.cache_miss'])
+        self.assertEqual(2, c['e.oov_default'])
+        self.assertEqual(2, c['e.emb_batch_words'])
+        self.assertEqual(1, c['e.lookup_batch_oov'])
+        self.assertEqual(3, m.snapshot()['histograms']['e.lookup']['count'])
+        e.disable_metrics()
+        e.emb('hello')
+        self.assertEqual(3, m.snapshot()['counters']['e.lookup'])
+
+    def test_concat(self):
+        a, b = Embedding(), Embedding()
+        for e, rows in [(a, [('hello', [1, 2])]), (b, [('hello', [3]), ('world', [4])])]:
+            e.d_emb = len(rows[0][1])
+            e.db = e.initialize_db(':memory:')
+            e.insert_batch(rows)
+        c = ConcatEmbedding([a, b], default='zero')
+        m = c.enable_metrics()
+        c.emb_batch(['hello', 'world'])
+        c.emb('hello')
+        s = m.snapshot()
+        self.assertEqual(1, s['counters']['ConcatEmbedding.emb_batch_oov'])
+        self.assertEqual(1, s['counters']['ConcatEmbedding.0.Embedding.oov_default'])
+        self.assertNotIn('ConcatEmbedding.1.Embedding.oov_default', s['counters'])
+        self.assertEqual(1, s['histograms']['ConcatEmbedding.1.Embedding.emb_batch']['count'])
+        self.assertEqual(1, s['histograms']['ConcatEmbedding.emb']['count'])
+        c.disable_metrics()
+        self.assertIsNone(a.metrics)
+
+    def test_kazuma(self):
+        k = KazumaCharEmbedding.__new__(KazumaCharEmbedding)
+        k.d_emb = 2
+        k.db = k.initialize_db(':memory:')
+        k.insert_batch([('2gram-#BEGIN#a', [1, 2]), ('2gram-ab', [3, 4])])
+        m = k.enable_metrics()
+        k.emb_batch(['ab', 'zz'])
+        c = m.snapshot()['counters']
+        self.assertEqual(1, c['KazumaCharEmbedding.emb_batch'])
+        self.assertEqual(1, c['KazumaCharEmbedding.oov_default'])
+        self.assertEqual(1, c['KazumaCharEmbedding.ngram_batch_oov'])
+        self.assertEqual(sum(len(k.grams(w)) for w in ['ab', 'zz']), c['KazumaCharEmbedding.ngrams'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+from embeddings.oov import hash_vector
+import numpy as np
+import unittest
+
+
+class TestOOV(unittest.TestCase):
+
+    def test_hash_vector(self):
+        v = hash_vector('hello', 300)
+        self.assertEqual((300,), v.shape)
+        self.assertEqual(np.float32, v.dtype)
+        self.assertTrue(np.all(np.abs(v) <= 0.1))
+        np.testing.assert_array_equal(v, hash_vector('hello', 300))
+        self.assertFalse(np.allclose(v, hash_vector('hellos', 300)))
+        self.assertFalse(np.allclose(v, hash_vector('hello', 300, seed=1)))
+        np.testing.assert_array_equal(v[:50], hash_vector('hello', 50))
+
+    def test_hash_vector_spread(self):
+        v = np.stack([hash_vector(str(i), 50) for i in range(200)])
+        self.assertAlmostEqual(0, v.mean(), places=2)
+        self.assertAlmostEqual(0.2 / np.sqrt(12), v.std(), places=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from embeddings.embedding import Embedding
+from embeddings.pool import ReaderPool
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import gc
+import threading
+import sqlite3
+import unittest
+import os
+
+
+def lookup_in_child(e, queue):
+    queue.put((os.getpid(), id(e.reader()), e.lookup('hello')))
+
+
+class TestReaderPool(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+        self.e = Embedding()
+        self.e.d_emb = 3
+        self.e.db = self.e.initialize_db(self.e.path('pool.db'))
+        self.e.insert_batch([('hello', [1, 2, 3]), ('world', [2, 3, 4])])
+
+    def tearDown(self):
+        if self.e.pool is not None:
+            self.e.pool.close()
+        self.e.db.close()
+        os.remove(self.e.path('pool.db'))
+
+    def test_connections(self):
+        pool = ReaderPool(self.e.path('pool.db'), immutable=True)
+        db = pool.get()
+        self.assertIs(db, pool.get())
+        other = ThreadPoolExecutor(1).submit(pool.get).result()
+        self.assertIsNot(db, other)
+        self.assertEqual(1, db.execute("select count(*) from embeddings where word = 'hello'").fetchone()[0])
+        self.assertGreater(db.execute('pragma mmap_size').fetchone()[0], 0)
+        with self.assertRaises(sqlite3.OperationalError):
+            db.execute("insert into embeddings values ('!', x'00')")
+        pool.close()
+        self.assertIsNot(db, pool.get())
+        pool.close()
+
+    def test_thread_exit(self):
+        pool = ReaderPool(self.e.path('pool.db'))
+        threads = [threading.Thread(target=lambda: pool.get().execute('select count(*) from embeddings').fetchone()) for _ in range(50)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        gc.collect()
+        # threads that exited closed their connections
+        self.assertEqual(0, len(pool.connections))
+        db = pool.get()
+        self.assertEqual(1, len(pool.connections))
+        pool.close()
+        with self.assertRaises(sqlite3.ProgrammingError):
+            db.execute('select 1')
+
+    def test_serve_threads(self):
+        self.e.serve()
+        self.assertIsNot(self.e.db, self.e.reader())
+        results = []
+
+        def work():
+            for _ in range(100):
+                results.append((self.e.lookup('world'), self.e.lookup_batch(['hello'])[0].tolist()))
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(400, len(results))
+        self.assertTrue(all(r == ([2, 3, 4], [[1, 2, 3]]) for r in results))
+        self.e.insert_batch([('!', [3, 4, 5])])
+        self.assertListEqual([3, 4, 5], self.e.lookup('!'))
+
+    def test_serve_fork(self):
+        self.e.serve(immutable=True)
+        parent = id(self.e.reader())
+        ctx = multiprocessing.get_context('fork')
+        queue = ctx.Queue()
+        p = ctx.Process(target=lookup_in_child, args=(self.e, queue))
+        p.start()
+        pid, conn, emb = queue.get(timeout=30)
+        p.join()
+        self.assertNotEqual(os.getpid(), pid)
+        self.assertListEqual([1, 2, 3], emb)
+        # the connection inherited from the parent is not reused by the child
+        self.assertNotEqual(parent, conn)
+        self.assertEqual(1, len(self.e.pool.connections))
+        self.assertEqual(parent, id(self.e.reader()))
+
+
+if __name__ == '__main__':
+    unittest.main()
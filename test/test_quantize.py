@@ -0,0 +1,46 @@
+from embeddings.matrix import MatrixStore, MatrixWriter
+from embeddings.quantize import codecs
+import numpy as np
+import unittest
+import shutil
+import os
+
+
+class TestQuantize(unittest.TestCase):
+
+    def setUp(self):
+        self.root = os.environ['EMBEDDINGS_ROOT'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_root')
+        self.dname = os.path.join(self.root, 'mystore.mmap')
+        self.embs = np.random.RandomState(0).randn(1000, 16).astype(np.float32)
+
+    def tearDown(self):
+        if os.path.isdir(self.dname):
+            shutil.rmtree(self.dname)
+
+    def test_codecs(self):
+        for name, max_error in [('float32', 1e-7), ('float16', 1e-3), ('int8', 0.05), ('pq', 0.7)]:
+            codec = codecs[name](16).fit(self.embs)
+            codes = codec.encode(self.embs)
+            self.assertEqual((1000, codec.code_size), codes.shape)
+            self.assertEqual(codec.dtype, codes.dtype)
+            self.assertLess(codec.reconstruction_error(self.embs)['relative_error'], max_error, name)
+
+    def test_store(self):
+        words = ['w{}'.format(i) for i in range(len(self.embs))]
+        for name in ['float16', 'int8', 'pq']:
+            with MatrixWriter(self.dname, 16, quantization=name) as w:
+                w.insert_matrix(words, self.embs)
+            self.assertFalse(os.path.isfile(os.path.join(self.dname, 'vectors.f32')))
+            store = MatrixStore(self.dname)
+            self.assertEqual(name, store.quantization)
+            self.assertIn('relative_error', store.meta['reconstruction'])
+            embs, oov = store.lookup_batch(['w3', 'w5', 'x'])
+            self.assertListEqual([False, False, True], oov.tolist())
+            np.testing.assert_allclose(store.lookup('w5'), embs[1])
+            store.load_memory()
+            np.testing.assert_allclose(store.lookup('w3'), embs[0])
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
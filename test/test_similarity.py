@@ -0,0 +1,25 @@
+from embeddings.similarity import normalize, search
+import numpy as np
+import unittest
+
+
+class TestSimilarity(unittest.TestCase):
+
+    def test_search_matches_brute_force(self):
+        rng = np.random.RandomState(0)
+        vectors = normalize(rng.randn(1000, 16).astype(np.float32))
+        queries = normalize(rng.randn(7, 16).astype(np.float32))
+        scores, ids = search(vectors, queries, k=5, block_size=64)
+        expected = np.argsort(-(queries @ vectors.T), axis=1)[:, :5]
+        self.assertListEqual(expected.tolist(), ids.tolist())
+        self.assertTrue(np.all(np.diff(scores, axis=1) <= 0))
+
+    def test_search_exclude(self):
+        vectors = np.eye(3, dtype=np.float32)
+        scores, ids = search(vectors, vectors, k=3, exclude=np.arange(3), block_size=2)
+        self.assertEqual((3, 2), ids.shape)
+        self.assertFalse(np.any(ids == np.arange(3)[:, None]))
+
+
+if __name__ == '__main__':
+    unittest.main()